@@ -0,0 +1,146 @@
+import asyncio
+import math
+import threading
+import time
+from collections import OrderedDict
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason, wait):
+        super().__init__(
+            "Too many concurrent assistant runs" if reason == "concurrency" else "Assistant run rate limit exceeded"
+        )
+        self.reason = reason
+        # Seconds until the run would fit, and the same in whole seconds as
+        # sent in the Retry-After header
+        self.wait = wait
+        self.retry_after = max(1, math.ceil(wait))
+
+    def headers(self):
+        return {"Retry-After": str(self.retry_after)}
+
+
+class Admission:
+    # A granted run; release() frees its concurrency slot and may be called
+    # more than once
+    def __init__(self, controller, client, concurrent):
+        self._controller = controller
+        self._client = client
+        self._held = concurrent
+
+    def release(self):
+        if self._held:
+            self._held = False
+            self._controller._release(self._client)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class AdmissionController:
+    """Per-client admission of assistant runs.
+
+    Each client (a user, an API key or an IP address) has a token bucket
+    refilled at ``rate`` runs per second up to ``burst``, and may hold at
+    most ``max_concurrent`` runs at once. A run that does not fit is refused
+    immediately with AdmissionRejected, which says when to retry, rather
+    than queued; callers that are bounded already can wait() instead.
+    ``rate`` or ``max_concurrent`` of 0 turns that limit off. Buckets of the
+    least recently seen clients are dropped beyond ``max_clients``; a
+    dropped client simply starts with a full bucket.
+    """
+
+    def __init__(self, rate=2.0, burst=20, max_concurrent=8, max_clients=10000, concurrency_retry_after=1):
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrent = max_concurrent
+        self.max_clients = max_clients
+        self.concurrency_retry_after = concurrency_retry_after
+        # client -> (tokens, updated_at)
+        self._buckets = OrderedDict()
+        # client -> runs in progress, only for clients with at least one
+        self._active = {}
+        self._lock = threading.Lock()
+        self.admitted = 0
+        self.rejected_rate = 0
+        self.rejected_concurrency = 0
+        self.waited = 0
+
+    def acquire(self, client, cost=1, concurrent=True):
+        # Charges cost tokens and, with concurrent, takes a run slot that the
+        # returned Admission releases. Raises AdmissionRejected.
+        admission, rejected = self._try(client, cost, concurrent)
+        if rejected is not None:
+            with self._lock:
+                if rejected.reason == "concurrency":
+                    self.rejected_concurrency += 1
+                else:
+                    self.rejected_rate += 1
+            raise rejected
+        return admission
+
+    async def wait(self, client, cost=1, concurrent=True, poll_interval=0.1):
+        # Like acquire, but sleeps until the run fits: as long as the bucket
+        # needs to refill, or poll_interval while all run slots are taken
+        if self.rate and cost > self.burst:
+            raise AdmissionRejected("rate", cost / self.rate)
+        admission, rejected = self._try(client, cost, concurrent)
+        if rejected is not None:
+            with self._lock:
+                self.waited += 1
+        while rejected is not None:
+            await asyncio.sleep(rejected.wait if rejected.reason == "rate" else poll_interval)
+            admission, rejected = self._try(client, cost, concurrent)
+        return admission
+
+    def stats(self):
+        with self._lock:
+            rejected = self.rejected_rate + self.rejected_concurrency
+            decisions = self.admitted + rejected
+            return {
+                "rate": self.rate,
+                "burst": self.burst,
+                "max_concurrent": self.max_concurrent,
+                "clients": len(self._buckets),
+                "active_runs": sum(self._active.values()),
+                "admitted": self.admitted,
+                "rejected_rate": self.rejected_rate,
+                "rejected_concurrency": self.rejected_concurrency,
+                "waited": self.waited,
+                "rejected_ratio": round(rejected / decisions, 4) if decisions else 0.0,
+            }
+
+    def _try(self, client, cost, concurrent):
+        # Returns (Admission, None), or (None, AdmissionRejected) without
+        # counting the rejection
+        now = time.monotonic()
+        with self._lock:
+            if concurrent and self.max_concurrent and self._active.get(client, 0) >= self.max_concurrent:
+                return None, AdmissionRejected("concurrency", self.concurrency_retry_after)
+            if self.rate:
+                tokens, updated_at = self._buckets.pop(client, (self.burst, now))
+                tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+                if tokens < cost:
+                    self._store(client, tokens, now)
+                    return None, AdmissionRejected("rate", (cost - tokens) / self.rate)
+                self._store(client, tokens - cost, now)
+            if concurrent:
+                self._active[client] = self._active.get(client, 0) + 1
+            self.admitted += 1
+        return Admission(self, client, concurrent), None
+
+    def _store(self, client, tokens, now):
+        self._buckets[client] = (tokens, now)
+        while len(self._buckets) > self.max_clients:
+            self._buckets.popitem(last=False)
+
+    def _release(self, client):
+        with self._lock:
+            count = self._active.get(client, 0) - 1
+            if count > 0:
+                self._active[client] = count
+            else:
+                self._active.pop(client, None)
@@ -0,0 +1,131 @@
+"""Assistant answer normalization: success rate and cost per answer.
+
+Runs a corpus of real-world answer shapes (clean JSON, code fences, prose
+around the object, trailing commas, truncated output, markdown without any
+JSON, both instruction schemas) through:
+
+legacy main:  json.loads, the old main.py /convertToJson/
+legacy jwt:   the regexes the old jwtAuthMain.py /convertToJson/ built per request
+normalizer:   InsightNormalizer
+
+Run from the repository root:
+
+    python benchmarks/bench_insight_normalizer.py [--repeat 2000]
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from insight_normalizer import InsightNormalizer  # noqa: E402
+
+STEPS = ["Keep a daily symptom diary.", "Review medication with the physician.", "Stay hydrated and rest."]
+SUMMARY = "The resident shows mild, stable symptoms with occasional fatigue over the last two weeks."
+CLEAN = json.dumps({"Summary": SUMMARY, "AI-Recommended Next Steps": STEPS}, indent=2)
+MEDICATIONS = json.dumps({
+    "Summary": SUMMARY,
+    "Suggested Medications": ["Paracetamol", "Oral rehydration salts", "Vitamin D"],
+    "Risk Profile": "Low Risk",
+    "Immediate Consultation Needed": "No",
+}, indent=2)
+
+CORPUS = {
+    "clean json": CLEAN,
+    "json fence": f"```json\n{CLEAN}\n```",
+    "bare fence": f"```\n{CLEAN}\n```",
+    "prose around": f"Here are the insights you asked for:\n\n{CLEAN}\n\nLet me know if you need anything else.",
+    "trailing commas": CLEAN.replace('"\n  ]', '",\n  ],').replace("]\n}", "],\n}"),
+    "failure answer": '{"Summary": "Insufficient data to provide an accurate overview.", '
+                      '"AI-Recommended Next Steps:" : "Insufficient data to provide an accurate overview."}',
+    "truncated": CLEAN[: len(CLEAN) - 40],
+    "markdown bullets": f"**Summary:** {SUMMARY}\n\n**AI-Recommended Next Steps:**\n" + "\n".join(f"- {s}" for s in STEPS),
+    "numbered list": f"Summary: {SUMMARY}\nAI-Recommended Next Steps:\n" + "\n".join(f"{i}. {s}" for i, s in enumerate(STEPS, 1)),
+    "medications json": MEDICATIONS,
+    "medications fence": f"```json\n{MEDICATIONS}\n```",
+    "medications markdown": f"### Summary: {SUMMARY}\n### Suggested Medications:\n1. Paracetamol\n2. Oral rehydration salts\n"
+                            f"### Risk Profile: Low Risk\n### Immediate Consultation Needed: No",
+    "no content": "I'm sorry, I can't help with that request.",
+}
+
+
+def legacy_main(text):
+    data = json.loads(text)
+    return {"summary": data.get("Summary", "").strip(), "AI-Recommended Next Steps": data.get("AI-Recommended Next Steps", [])}
+
+
+def legacy_jwt(text):
+    response_json = {"summary": None, "medications": [], "risk profile": None, "consultation_needed": None}
+
+    def clean_text(value):
+        return re.sub(r'[^A-Za-z0-9\s]', '', value).strip()
+    summary_match = re.search(r"(?i)summary[:\-\s\*#]*([^\*\#]*?)(?=\n|$)", text, re.DOTALL)
+    if summary_match:
+        response_json["summary"] = clean_text(summary_match.group(1).strip())
+    medications_match = re.search(r"(?i)suggested\s+medications[:\-\s\*#]*([\s\S]*?)(?=###|risk|immediate|$)", text, re.DOTALL)
+    if medications_match:
+        medications = re.split(r'\s*\d+\.\s*|\n|,\s*', medications_match.group(1).strip())
+        response_json["medications"] = [clean_text(med) for med in medications if clean_text(med)]
+    risk_match = re.search(r"(?i)(risk\s+profile|risk)[:\-\s\*#]*([^\*\#]*?)(?=\n|$)", text, re.DOTALL)
+    if risk_match:
+        response_json["risk profile"] = clean_text(risk_match.group(2))
+    consultation_match = re.search(r"(?i)immediate\s+consultation\s+needed[:\-\s\*#]*([^\*\#]*?)(?=\n|$)", text, re.DOTALL)
+    if consultation_match:
+        response_json["consultation_needed"] = clean_text(consultation_match.group(1))
+    return response_json
+
+
+def legacy_main_ok(text):
+    try:
+        result = legacy_main(text)
+    except json.JSONDecodeError:
+        return False
+    return bool(result["summary"])
+
+
+def legacy_jwt_ok(text):
+    result = legacy_jwt(text)
+    return bool(result["summary"] and result["medications"])
+
+
+def normalizer_ok(normalizer, text):
+    result = normalizer.normalize(text)
+    insights = result.insights
+    return result.method != "none" and bool(insights.summary), result
+
+
+def time_per_call(fn, text, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        try:
+            fn(text)
+        except json.JSONDecodeError:
+            pass
+    return (time.perf_counter() - started) / repeat * 1e6
+
+
+def run():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+    normalizer = InsightNormalizer()
+
+    print(f"{'answer':<22} {'main ok':>7} {'jwt ok':>6} {'new ok':>6} {'path':<28} "
+          f"{'main us':>8} {'jwt us':>7} {'new us':>7}")
+    totals = [0, 0, 0]
+    for name, text in CORPUS.items():
+        main_ok = legacy_main_ok(text)
+        jwt_ok = legacy_jwt_ok(text)
+        new_ok, result = normalizer_ok(normalizer, text)
+        totals = [totals[0] + main_ok, totals[1] + jwt_ok, totals[2] + new_ok]
+        print(f"{name:<22} {main_ok!s:>7} {jwt_ok!s:>6} {new_ok!s:>6} {result.schema_version + '/' + result.method:<28} "
+              f"{time_per_call(legacy_main, text, args.repeat):>8.1f} {time_per_call(legacy_jwt, text, args.repeat):>7.1f} "
+              f"{time_per_call(normalizer.normalize, text, args.repeat):>7.1f}")
+    print(f"\nusable answers out of {len(CORPUS)}: legacy main {totals[0]}, legacy jwt {totals[1]}, normalizer {totals[2]}")
+
+
+if __name__ == "__main__":
+    run()
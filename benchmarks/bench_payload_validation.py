@@ -0,0 +1,110 @@
+"""Request-body validation cost for /getPrompts/, before and after the raw-bytes path.
+
+before: RequestPayload model tree from the body, then .dict() for extractData
+after:  request_payload_adapter.validate_json straight into dicts
+
+Reports median latency and peak traced allocation per request for payloads
+of growing size, for validation alone and together with extractData. Run from the repository root:
+
+    python benchmarks/bench_payload_validation.py [--repeat 20]
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Importing main creates the LLM backend; the stub needs no API key
+os.environ.setdefault("LLM_BACKEND", "stub")
+
+import main  # noqa: E402
+
+TITLES = ["Cough", "Fatigue", "Headache", "Fever", "Joint Pain", "Nausea", "Shortness of Breath", "Dizziness"]
+
+
+def make_payload(records_per_disease, diseases=4, seed=0):
+    rng = random.Random(seed)
+    return {
+        "message": "bench",
+        "resident": {"name": "Bench Resident", "age": 71, "gender": "F"},
+        "residentID": "bench",
+        "diseases": [
+            {
+                "disease_id": f"d{d}",
+                "ds_name": f"Disease {d}",
+                "updatedAt": "2024-01-01T00:00:00.000Z",
+                "highValueSymptoms": [],
+                "records": [
+                    {
+                        "recordName": f"record {i}",
+                        "_id": f"{d}-{i}",
+                        "updatedAt": f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:00.000Z",
+                        "status": "active",
+                        "symptoms": [
+                            {"title": title, "value": rng.choice([0, 1, 2.5, 4, 6.75, 8, 10])}
+                            for title in rng.sample(TITLES, 4)
+                        ],
+                    }
+                    for i in range(records_per_disease)
+                ],
+            }
+            for d in range(diseases)
+        ],
+    }
+
+
+def validate_before(body):
+    return main.RequestPayload.model_validate_json(body).model_dump()
+
+
+def validate_after(body):
+    return main.request_payload_adapter.validate_json(body)
+
+
+def before(body):
+    return main.extractData(validate_before(body))
+
+
+def after(body):
+    return main.extractData(validate_after(body))
+
+
+def measure(fn, body, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(body)
+        timings.append((time.perf_counter() - started) * 1000)
+    tracemalloc.start()
+    fn(body)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return statistics.median(timings), peak / 1024
+
+
+def run():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50, 500, 5000])
+    args = parser.parse_args()
+
+    bodies = [(size * 4, json.dumps(make_payload(size)).encode()) for size in args.sizes]
+    for _, body in bodies:
+        assert before(body) == after(body)
+
+    for label, pair in (("validation only", (validate_before, validate_after)),
+                        ("validation + extractData", (before, after))):
+        print(f"\n{label}")
+        print(f"{'records':>8} {'body KiB':>9} {'before ms':>10} {'after ms':>9} {'before KiB':>11} {'after KiB':>10}")
+        for records, body in bodies:
+            before_ms, before_kib = measure(pair[0], body, args.repeat)
+            after_ms, after_kib = measure(pair[1], body, args.repeat)
+            print(f"{records:>8} {len(body) / 1024:>9.0f} {before_ms:>10.2f} {after_ms:>9.2f} {before_kib:>11.0f} {after_kib:>10.0f}")
+
+
+if __name__ == "__main__":
+    run()
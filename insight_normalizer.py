@@ -0,0 +1,198 @@
+import re
+from typing import Optional, Union
+
+from pydantic import BaseModel, ConfigDict, Field
+
+from insight_parsing import STEPS_KEY, SUMMARY_KEY, InsightParseError, parse_insights_json
+
+
+# main.py's instructions: a summary plus a list of next steps
+SCHEMA_RECOMMENDATIONS = "recommendations_v2"
+# jwtAuthMain.py's instructions: summary, medications, risk and consultation
+SCHEMA_MEDICATIONS = "medications_v1"
+
+MEDICATION_KEYS = ("Suggested Medications", "Risk Profile", "Immediate Consultation Needed")
+
+TRAILING_COMMA = re.compile(r",\s*([}\]])")
+MEDICATIONS_MARKER = re.compile(r"(?i)suggested\s+medications|risk\s+profile|immediate\s+consultation")
+
+# Fallback extractors for answers that contain no usable JSON. The
+# medications ones are the patterns jwtAuthMain's /convertToJson/ used.
+CLEAN_TEXT = re.compile(r"[^A-Za-z0-9\s]")
+SUMMARY_PATTERN = re.compile(r"(?i)summary[:\-\s\*#]*([^\*\#]*?)(?=\n|$)", re.DOTALL)
+MEDICATIONS_PATTERN = re.compile(r"(?i)suggested\s+medications[:\-\s\*#]*([\s\S]*?)(?=###|risk|immediate|$)", re.DOTALL)
+MEDICATIONS_SPLIT = re.compile(r"\s*\d+\.\s*|\n|,\s*")
+RISK_PATTERN = re.compile(r"(?i)(risk\s+profile|risk)[:\-\s\*#]*([^\*\#]*?)(?=\n|$)", re.DOTALL)
+CONSULTATION_PATTERN = re.compile(r"(?i)immediate\s+consultation\s+needed[:\-\s\*#]*([^\*\#]*?)(?=\n|$)", re.DOTALL)
+STEPS_SUMMARY_PATTERN = re.compile(r"(?i)summary[\"':\-\s\*#]*(.+?)(?:\"\s*[,}]|[\"\s,]*(?=\n|$))")
+STEPS_PATTERN = re.compile(r"(?i)AI-Recommended\s+Next\s+Steps[:\*#\"]*([\s\S]*?)(?=###|$)")
+QUOTED_ITEM = re.compile(r'"([^"]+)"')
+BULLET_ITEM = re.compile(r"^\s*(?:[-*•]|\d+[.)])\s+(.+?)\s*$", re.MULTILINE)
+
+
+class RecommendationInsights(BaseModel):
+    model_config = ConfigDict(populate_by_name=True)
+
+    summary: str = ""
+    next_steps: list[str] = Field(default_factory=list, alias="AI-Recommended Next Steps")
+
+
+class MedicationInsights(BaseModel):
+    model_config = ConfigDict(populate_by_name=True)
+
+    summary: Optional[str] = None
+    medications: list[str] = Field(default_factory=list)
+    risk_profile: Optional[str] = Field(default=None, alias="risk profile")
+    consultation_needed: Optional[str] = None
+
+
+class NormalizedInsights(BaseModel):
+    # Which schema the answer was read as and how: "json", "fenced",
+    # "embedded", "repaired" (JSON after dropping trailing commas), "regex",
+    # or "none" when nothing could be extracted
+    schema_version: str
+    method: str
+    insights: Union[RecommendationInsights, MedicationInsights]
+
+    def response(self):
+        # The response shape of the /convertToJson/ endpoints
+        return self.insights.model_dump(by_alias=True)
+
+
+def clean_text(text):
+    return CLEAN_TEXT.sub("", text).strip()
+
+
+def as_list(value):
+    # The failure answer has a plain string where a list is expected
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [value.strip()] if value.strip() else []
+    if isinstance(value, dict):
+        # Numbered steps sent as {"1": "...", "2": "..."}
+        value = list(value.values())
+    elif not isinstance(value, (list, tuple)):
+        return [str(value)]
+    return [str(item).strip() for item in value]
+
+
+def risk_label(value):
+    value = value.lower()
+    if "low" in value:
+        return "Low Risk"
+    if "moderate" in value:
+        return "Moderate Risk"
+    if "high" in value:
+        return "High Risk"
+    if "medium" in value:
+        return "Medium Risk"
+    return "None"
+
+
+def consultation_label(value):
+    value = value.lower()
+    if "yes" in value:
+        return "Yes"
+    if "may" in value:
+        return "May be"
+    if "no" in value:
+        return "No"
+    return None
+
+
+def from_json(data):
+    if any(key in data for key in MEDICATION_KEYS):
+        risk = data.get("Risk Profile")
+        consultation = data.get("Immediate Consultation Needed")
+        return SCHEMA_MEDICATIONS, MedicationInsights(
+            summary=str(data.get(SUMMARY_KEY, "")).strip() or None,
+            medications=as_list(data.get("Suggested Medications")),
+            risk_profile=risk_label(str(risk)) if risk else None,
+            consultation_needed=consultation_label(str(consultation)) if consultation else None,
+        )
+    return SCHEMA_RECOMMENDATIONS, RecommendationInsights(
+        summary=str(data.get(SUMMARY_KEY, "")).strip(),
+        next_steps=as_list(data.get(STEPS_KEY)),
+    )
+
+
+def medications_from_text(text):
+    insights = MedicationInsights()
+    summary_match = SUMMARY_PATTERN.search(text)
+    if summary_match:
+        insights.summary = clean_text(summary_match.group(1).strip())
+    medications_match = MEDICATIONS_PATTERN.search(text)
+    if medications_match:
+        medications = MEDICATIONS_SPLIT.split(medications_match.group(1).strip())
+        insights.medications = [clean_text(med) for med in medications if clean_text(med)]
+    risk_match = RISK_PATTERN.search(text)
+    if risk_match:
+        insights.risk_profile = risk_label(clean_text(risk_match.group(2)))
+    consultation_match = CONSULTATION_PATTERN.search(text)
+    if consultation_match:
+        insights.consultation_needed = consultation_label(clean_text(consultation_match.group(1)))
+    found = insights.summary or insights.medications or insights.risk_profile or insights.consultation_needed
+    return insights, bool(found)
+
+
+def recommendations_from_text(text):
+    insights = RecommendationInsights()
+    summary_match = STEPS_SUMMARY_PATTERN.search(text)
+    if summary_match:
+        insights.summary = summary_match.group(1).strip()
+    steps_match = STEPS_PATTERN.search(text)
+    if steps_match:
+        steps_text = steps_match.group(1)
+        insights.next_steps = QUOTED_ITEM.findall(steps_text) or BULLET_ITEM.findall(steps_text)
+    return insights, bool(insights.summary or insights.next_steps)
+
+
+class InsightNormalizer:
+    """Reads assistant answers of either instruction schema.
+
+    JSON is tried first (plain, fenced, embedded in prose, then with
+    trailing commas removed); the schema is told apart by its keys. Answers
+    without JSON go through the precompiled regex extractors of whichever
+    schema the text mentions. Counts how often each path is taken.
+    """
+
+    def __init__(self):
+        self.counts = {}
+
+    def normalize(self, text):
+        result = self._normalize(text)
+        key = f"{result.schema_version}/{result.method}"
+        self.counts[key] = self.counts.get(key, 0) + 1
+        return result
+
+    def _normalize(self, text):
+        try:
+            data, method = parse_insights_json(text)
+        except InsightParseError:
+            data, method = None, None
+            repaired = TRAILING_COMMA.sub(r"\1", text)
+            if repaired != text:
+                try:
+                    data, _ = parse_insights_json(repaired)
+                    method = "repaired"
+                except InsightParseError:
+                    pass
+        if data is not None:
+            schema_version, insights = from_json(data)
+            return NormalizedInsights(schema_version=schema_version, method=method, insights=insights)
+
+        if MEDICATIONS_MARKER.search(text):
+            schema_version, (insights, found) = SCHEMA_MEDICATIONS, medications_from_text(text)
+        else:
+            schema_version, (insights, found) = SCHEMA_RECOMMENDATIONS, recommendations_from_text(text)
+        return NormalizedInsights(schema_version=schema_version, method="regex" if found else "none", insights=insights)
+
+    def stats(self):
+        total = sum(self.counts.values())
+        fallback = sum(count for key, count in self.counts.items() if not key.endswith("/json"))
+        return {
+            "normalized": total,
+            "fallback_ratio": round(fallback / total, 4) if total else 0.0,
+            "paths": dict(self.counts),
+        }
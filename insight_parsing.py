@@ -0,0 +1,154 @@
+import json
+import re
+
+
+SUMMARY_KEY = "Summary"
+STEPS_KEY = "AI-Recommended Next Steps"
+
+# Response format of the assistant runs. With strict mode the model can only
+# produce an object of exactly this shape.
+INSIGHTS_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "resident_insights",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                SUMMARY_KEY: {"type": "string"},
+                STEPS_KEY: {"type": "array", "items": {"type": "string"}},
+            },
+            "required": [SUMMARY_KEY, STEPS_KEY],
+            "additionalProperties": False,
+        },
+    },
+}
+
+FENCED_BLOCK = re.compile(r"```(?:json|JSON)?\s*(.*?)```", re.DOTALL)
+_decoder = json.JSONDecoder()
+
+
+class InsightParseError(ValueError):
+    pass
+
+
+def parse_insights_json(text):
+    # Returns (object, method). Plain JSON first; then the contents of a
+    # ``` fenced block; then the first JSON object embedded in surrounding
+    # prose. Raises InsightParseError when there is no JSON object at all.
+    stripped = text.strip()
+    try:
+        value = json.loads(stripped)
+        if isinstance(value, dict):
+            return value, "json"
+    except json.JSONDecodeError:
+        pass
+
+    for block in FENCED_BLOCK.findall(text):
+        try:
+            value = json.loads(block.strip())
+        except json.JSONDecodeError:
+            continue
+        if isinstance(value, dict):
+            return value, "fenced"
+
+    start = text.find("{")
+    while start != -1:
+        try:
+            value, _ = _decoder.raw_decode(text, start)
+        except json.JSONDecodeError:
+            value = None
+        if isinstance(value, dict):
+            return value, "embedded"
+        start = text.find("{", start + 1)
+
+    raise InsightParseError("No JSON object found in the assistant answer")
+
+
+class StreamingInsightParser:
+    """Incremental parser over the assistant's answer as it streams in.
+
+    feed() takes the next text delta and returns the events it completed:
+    ("summary", text) as soon as the Summary string closes and ("step",
+    {"index", "text"}) as each AI-Recommended Next Steps element closes.
+    Text before the first "{" (prose, a code fence) is skipped, and nothing
+    after the top-level object is read.
+    """
+
+    def __init__(self):
+        # Open containers, "{" or "[", of the top-level object
+        self._stack = []
+        self._started = False
+        self._finished = False
+        self._in_string = False
+        self._escape = False
+        self._string = []
+        self._expect_key = False
+        self._key = None
+        self._in_steps = False
+        self._steps = 0
+
+    def feed(self, text):
+        events = []
+        for char in text:
+            if self._finished:
+                break
+            if self._in_string:
+                self._string.append(char)
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    self._string_closed(events)
+                continue
+            if not self._started:
+                if char == "{":
+                    self._started = True
+                    self._open("{")
+                continue
+
+            if char == '"':
+                self._in_string = True
+                self._string = [char]
+            elif char in "{[":
+                if char == "[" and self._stack == ["{"] and self._key == STEPS_KEY:
+                    self._in_steps = True
+                self._open(char)
+            elif char in "}]":
+                self._stack.pop()
+                if len(self._stack) == 1:
+                    self._in_steps = False
+                elif not self._stack:
+                    self._finished = True
+            elif char == ":" and len(self._stack) == 1:
+                self._expect_key = False
+            elif char == "," and self._stack == ["{"]:
+                self._expect_key = True
+        return events
+
+    def _open(self, char):
+        self._stack.append(char)
+        if self._stack == ["{"]:
+            self._expect_key = True
+
+    def _string_closed(self, events):
+        try:
+            value = json.loads("".join(self._string))
+        except json.JSONDecodeError:
+            return
+        if self._stack == ["{"]:
+            if self._expect_key:
+                self._key = value
+            elif self._key == SUMMARY_KEY:
+                events.append(("summary", value.strip()))
+            elif self._key == STEPS_KEY:
+                # The failure answer gives a single string instead of a list
+                events.append(self._step(value))
+        elif self._in_steps and self._stack == ["{", "["]:
+            events.append(self._step(value))
+
+    def _step(self, value):
+        self._steps += 1
+        return "step", {"index": self._steps - 1, "text": value}
@@ -0,0 +1,155 @@
+import asyncio
+import json
+import os
+import sqlite3
+import time
+import uuid
+
+
+class JobQueue:
+    """SQLite-backed queue of background jobs with an asyncio worker pool.
+
+    Jobs are written to disk before ``submit`` returns. A worker claims a job
+    by taking a time-limited lease on it. If the process dies mid-job, the
+    lease runs out and another worker, in this process or another one sharing
+    the database file, picks the job up again, up to ``max_attempts`` times.
+    """
+
+    def __init__(self, db_path, handler, workers=4, max_attempts=3, lease_seconds=120, idle_poll=1.0):
+        # handler(payload dict) -> awaitable JSON-serializable result
+        self._handler = handler
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self.idle_poll = idle_poll
+        self._tasks = []
+        self._wakeup = None
+
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, status TEXT NOT NULL, payload TEXT NOT NULL, "
+            "result TEXT, error TEXT, attempts INTEGER NOT NULL DEFAULT 0, "
+            "lease_expires REAL, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+
+    def submit(self, payload):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._db.execute(
+            "INSERT INTO jobs (id, status, payload, created_at, updated_at) VALUES (?, 'queued', ?, ?, ?)",
+            (job_id, json.dumps(payload), now, now),
+        )
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job_id
+
+    def get(self, job_id):
+        row = self._db.execute(
+            "SELECT id, status, result, error, attempts, created_at, updated_at FROM jobs WHERE id = ?",
+            (job_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        job_id, status, result, error, attempts, created_at, updated_at = row
+        return {
+            "job_id": job_id,
+            "status": status,
+            "result": json.loads(result) if result is not None else None,
+            "error": error,
+            "attempts": attempts,
+            "created_at": created_at,
+            "updated_at": updated_at,
+        }
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self):
+        rows = self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {"workers": len(self._tasks), **{status: count for status, count in rows}}
+
+    def _claim(self):
+        now = time.time()
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._db.execute(
+                "SELECT id, payload, attempts FROM jobs "
+                "WHERE status = 'queued' OR (status = 'running' AND lease_expires < ?) "
+                "ORDER BY created_at LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                self._db.execute("COMMIT")
+                return None
+
+            job_id, payload, attempts = row
+            if attempts >= self.max_attempts:
+                # Crashed mid-job on its last attempt
+                self._db.execute(
+                    "UPDATE jobs SET status = 'failed', error = ?, updated_at = ? WHERE id = ?",
+                    ("Job was interrupted too many times", now, job_id),
+                )
+                self._db.execute("COMMIT")
+                return self._claim()
+
+            self._db.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, lease_expires = ?, "
+                "updated_at = ? WHERE id = ?",
+                (now + self.lease_seconds, now, job_id),
+            )
+            self._db.execute("COMMIT")
+            return job_id, json.loads(payload), attempts + 1
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+
+    def _finish(self, job_id, status, result=None, error=None):
+        self._db.execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, lease_expires = NULL, updated_at = ? WHERE id = ?",
+            (status, json.dumps(result) if result is not None else None, error, time.time(), job_id),
+        )
+
+    async def _worker(self):
+        while True:
+            claimed = self._claim()
+            if claimed is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.idle_poll)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            job_id, payload, attempt = claimed
+            try:
+                result = await asyncio.wait_for(self._handler(payload), timeout=self.lease_seconds)
+            except asyncio.CancelledError:
+                # Shutting down: hand the job back without using up an attempt
+                self._db.execute(
+                    "UPDATE jobs SET status = 'queued', attempts = attempts - 1, lease_expires = NULL, "
+                    "updated_at = ? WHERE id = ?",
+                    (time.time(), job_id),
+                )
+                raise
+            except Exception as e:
+                error = getattr(e, "detail", None) or str(e) or type(e).__name__
+                if attempt >= self.max_attempts:
+                    self._finish(job_id, "failed", error=str(error))
+                else:
+                    self._finish(job_id, "queued", error=str(error))
+                continue
+            self._finish(job_id, "succeeded", result=result)
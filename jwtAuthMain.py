@@ -2,38 +2,60 @@ from fastapi import FastAPI, HTTPException, Depends , status
 from pydantic import BaseModel
 import os
 import uvicorn
-import time
-from openai import OpenAI
+import asyncio
+from openai import AsyncOpenAI
 import requests
 from dotenv import load_dotenv
 import json
-import re
 from typing import Dict, Any 
-from datetime import datetime, timedelta ,timezone
 from dotenv import load_dotenv
 from fastapi.security import OAuth2PasswordBearer
 import jwt 
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from typing import Optional
-import secrets
 import datetime 
+from run_poller import RunPoller, RunPollTimeout
+from prompt_templates import PromptTemplateRegistry, render_sections
+from insight_normalizer import InsightNormalizer
+from symptom_logs import collectSymptomLogs, windowedPayload
+from token_cache import TokenClaimCache
+from jwt_keys import KeyRing
+from admission import AdmissionController, AdmissionRejected
 
 load_dotenv()
 
 # Load environment variables
-SECRET_KEY = secrets.token_urlsafe(32)  # Secure secret key for signing JWT
 ALGORITHM = os.getenv("ALGORITHM", "HS256")  # Default algorithm
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))  # Default expiration time
 USERNAME = os.getenv("USERNAME")
 PASSWORD = os.getenv("PASSWORD")
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", 10000))  # Verified tokens kept in memory
+JWT_KEYS_RELOAD_SECONDS = float(os.getenv("JWT_KEYS_RELOAD_SECONDS", 5))  # How often the key file is checked
 
 # Initialize FastAPI app
 app = FastAPI()
-
-client = OpenAI()
-
-thread_cache = {}
-client.api_key = os.getenv("OPENAI_API_KEY")
+# Per-user limits on assistant runs, keyed on the token's sub
+admission = AdmissionController(
+    rate=float(os.getenv("ADMISSION_RATE", 2)),
+    burst=int(os.getenv("ADMISSION_BURST", 20)),
+    max_concurrent=int(os.getenv("ADMISSION_MAX_CONCURRENT", 8)),
+)
+
+async_client = AsyncOpenAI()
+
+async_client.api_key = os.getenv("OPENAI_API_KEY")
+run_poller = RunPoller(
+    lambda thread_id, run_id: async_client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run_id)
+)
+prompt_templates = PromptTemplateRegistry()
+if os.getenv("PROMPT_TEMPLATES_FILE"):
+    prompt_templates.load_file(os.getenv("PROMPT_TEMPLATES_FILE"))
+PROMPT_TEMPLATE = prompt_templates.get("recent_15d")
+insight_normalizer = InsightNormalizer()
+token_cache = TokenClaimCache(max_entries=TOKEN_CACHE_SIZE)
+# Signing keys from JWT_KEYS_FILE / JWT_KEYS / SECRET_KEY, the same on every worker.
+# Cached claims are dropped when a key is retired or replaced.
+key_ring = KeyRing.from_env(algorithm=ALGORITHM, reload_interval=JWT_KEYS_RELOAD_SECONDS, on_change=token_cache.clear)
 # Security headers
 security = HTTPBearer()
 
@@ -58,16 +80,20 @@ def create_access_token(data: Dict):
     to_encode.update({"exp": expire})
     
     # Create JWT token
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    # Signed with the active key, named in the kid header
+    key_ring.refresh()
+    encoded_jwt = key_ring.encode(to_encode)
     return encoded_jwt
 
 def verify_token(token: str):
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        key_ring.refresh()
+        # Claims of a token verified before are served from the cache until its exp
+        payload = token_cache.verify(token, key_ring.decode)
         return payload
     except jwt.ExpiredSignatureError:
         raise Exception("Token has expired")
-    except jwt.JWTError:
+    except jwt.InvalidTokenError:
         raise Exception("Invalid token")
 
 
@@ -86,122 +112,23 @@ def login(request: LoginRequest):
     return {"access_token": access_token, "token_type": "bearer"}
 
 
-def extractData(apiResponse):
+# The payload is cut to the window first (the last 15 days unless since,
+# until or last_n_days say otherwise) with a binary search per disease, so
+# records outside it are never parsed or rendered.
+def extractData(apiResponse, since=None, until=None, last_n_days=15):
     try:
-        # Retrieve resident details
-        resident = apiResponse.get("resident", {})
-        name = resident.get("name", "Unknown")
-        age = resident.get("age", "Unknown")
-        gender = resident.get("gender", "Unknown")
-
-        diseases_data = apiResponse.get("diseases", [])
-        extracted_data = []
-        common_symptoms = {}
-        current_date = datetime.now(timezone.utc)
-        cutoff_date = current_date - timedelta(days=15)  # Past 15 days
-
-        # Iterate over each disease in the diseases list
-        for disease in diseases_data:
-            ds_name = disease.get("ds_name")
-            records = disease.get("records", [])
-
-            disease_details = []
-
-            for record in records:
-                record_date_str = record.get("updatedAt")
-                if not record_date_str:
-                    continue
-
-                # Parse the ISO 8601 date format with UTC timezone
-                try:
-                    record_date = datetime.fromisoformat(record_date_str.replace("Z", "+00:00"))
-                except ValueError:
-                    continue
-
-                # Compare against the cutoff date
-                if record_date >= cutoff_date:
-                    symptoms_list = record.get("symptoms", [])
-                    log_time = record_date.strftime("%I:%M %p")
-                    log_date = record_date.strftime("%d %B %Y")
-
-                    symptoms = {
-                        symptom.get("title"): round(symptom.get("value"), 2)
-                        for symptom in symptoms_list
-                        if symptom.get('value', 0) > 0
-                    }
-
-                    # Store the detailed log for the disease
-                    if symptoms:
-                        disease_details.append({
-                            "date": log_date,
-                            "time": log_time,
-                            "symptoms": symptoms
-                        })
-
-                        # Add to common symptoms
-                        for title, value in symptoms.items():
-                            if title not in common_symptoms:
-                                common_symptoms[title] = []
-                            common_symptoms[title].append((log_date, log_time, value))
-
-            if disease_details:
-                extracted_data.append((ds_name, disease_details))
-
-        # If no data found within the past 15 days
-        if not extracted_data:
-            return (
-                f"Personal Information: Name: {name}, Age: {age}, Gender: {gender}.\n"
-                f"There is no disease or symptom added recently within the past 15 days."
-            )
-
-        # Construct the prompt for available data
-        prompt = f"Personal Information: Name: {name}, Age: {age}, Gender: {gender}.\nMedical History and Symptoms:"
-
-        for idx, (ds_name, details) in enumerate(extracted_data, 1):
-            prompt += f"\n{idx}. {ds_name}, Date of Diagnosis: {details[0]['date']} at {details[0]['time']} with multiple symptom logs."
-            for log in details:
-                log_date = log["date"]
-                log_time = log["time"]
-                symptoms = ", ".join([f"{key}: {value}/10" for key, value in log["symptoms"].items()])
-                prompt += f"\nSymptom Log at {log_date}, {log_time}: {symptoms}."
-
-        # Add common symptoms over time
-        if common_symptoms:
-            prompt += "\n\nCommon Symptoms Logged Over Time:"
-            for title, occurrences in common_symptoms.items():
-                for log_date, log_time, value in occurrences:
-                    prompt += f"\n{log_date}, {log_time}: {title}: {value}/10."
-
-        # Add the request
-        prompt += "\n\nRequest: Provide guidance or recommendations for medication based on the above symptoms and conditions."
-
-        return prompt
+        data = windowedPayload(apiResponse, since, until, None if since or until else last_n_days)
+        resident, extracted_data, common_symptoms = collectSymptomLogs(data)
+        # Same wording as before ("Unknown" defaults, 15-day note), now kept
+        # with the other prompt formats in prompt_templates
+        return "".join(render_sections(PROMPT_TEMPLATE, resident, extracted_data, common_symptoms))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
-        
 
-# Function to interact with assistant and get a response for each prompt
-def getAssistantResponse(prompt, assistant_id, vector_store_id, max_retries=10, retry_delay=2):
-    try:
-        # responses = []
-        # Iterate through each prompt and get a response
-        thread_id = thread_cache.get(assistant_id)
-        
-        # Check if thread exists; if completed, reset it
-        if thread_id:
-            try:
-                run_response = client.beta.threads.get(thread_id=thread_id)
-                if run_response["status"] == "completed":
-                    thread_cache.pop(assistant_id, None)
-                    thread_id = None
-            except Exception:
-                thread_cache.pop(assistant_id, None)
-                thread_id = None
-        
-        # Create a new thread if no valid one exists
-        if not thread_id:
-            response = client.beta.threads.create_and_run(
-                instructions='''Response Format Restriction: Always provide insights in the exact JSON format as shown below, and do not include any additional information or explanation.\n
+
+ASSISTANT_INSTRUCTIONS = '''Response Format Restriction: Always provide insights in the exact JSON format as shown below, and do not include any additional information or explanation.\n
                 {
                     "Summary": "overview of current condition in 50 words",
                     "Suggested Medications": ["medication1", "medication2", "medication3"],
@@ -229,42 +156,72 @@ def getAssistantResponse(prompt, assistant_id, vector_store_id, max_retries=10,
                     "Suggested Medications": [],
                     "Risk Profile": "Low Risk",
                     "Immediate Consultation Needed": "No"
-                }''',
-                assistant_id=assistant_id,
-                thread={
-                    "messages": [{"role": "user", "content": prompt}],
-                    "tool_resources": {"file_search": {"vector_store_ids": vector_store_id}},
-                },
-                extra_headers={"OpenAI-Beta": "assistants=v2"} 
-            )
-            thread_id = response.thread_id
-            thread_cache[assistant_id] = thread_id
-            run_id = response.id
-        else:
-            # Use the existing thread
-            run_response = client.beta.threads.runs.create(
-                thread_id=thread_id, messages=[{"role": "user", "content": prompt}]
-            )
-            run_id = run_response.id
-
-        # Retry loop to check for completion
-        retries = 0
-        while retries < max_retries:
-            run_status = client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run_id)
-            if run_status.status == "completed":
-                # Retrieve the last message in the thread
-                thread_messages = client.beta.threads.messages.list(thread_id=thread_id, limit=5, order="desc")
-                responses  = thread_messages.data[0].content[0].text.value
-                # responses.append(response_content)
-                break  # Exit retry loop on success
-            time.sleep(retry_delay)
-            retries += 1
-        else:
-            responses = ("The assistant did not respond in time for this prompt. Please try again.")
-        
+                }'''
+
+
+# Deletes a finished call's thread, cancelling its run first if it did not
+# complete. Runs in the background, so the response is not held up by it.
+async def deleteThread(thread_id, run_id=None):
+    try:
+        if run_id is not None:
+            await async_client.beta.threads.runs.cancel(thread_id=thread_id, run_id=run_id)
+    except Exception as e:
+        print(f"Error cancelling run {run_id}: {e}")
+    try:
+        await async_client.beta.threads.delete(thread_id)
+    except Exception as e:
+        print(f"Error deleting thread {thread_id}: {e}")
+
+
+cleanup_tasks = set()
+
+
+# Function to interact with assistant and get a response for each prompt.
+# Every call gets its own thread, deleted once the answer has been read, and
+# completion is awaited on the shared run poller so the event loop is never
+# blocked.
+async def getAssistantResponse(prompt, assistant_id, vector_store_id, max_retries=10, retry_delay=2):
+    thread_id = run_id = None
+    finished = False
+    try:
+        response = await async_client.beta.threads.create_and_run(
+            instructions=ASSISTANT_INSTRUCTIONS,
+            assistant_id=assistant_id,
+            thread={
+                "messages": [{"role": "user", "content": prompt}],
+                "tool_resources": {"file_search": {"vector_store_ids": vector_store_id}},
+            },
+            extra_headers={"OpenAI-Beta": "assistants=v2"}
+        )
+        thread_id = response.thread_id
+        run_id = response.id
+
+        try:
+            run_status = await run_poller.wait(thread_id, run_id, timeout=max_retries * retry_delay)
+        except RunPollTimeout:
+            return "The assistant did not respond in time for this prompt. Please try again."
+
+        if run_status.status != "completed":
+            detail = f"Assistant run ended with status '{run_status.status}'"
+            if getattr(run_status, "last_error", None):
+                detail += f": {run_status.last_error.message}"
+            raise HTTPException(status_code=502, detail=detail)
+        finished = True
+
+        # Retrieve the last message in the thread
+        thread_messages = await async_client.beta.threads.messages.list(thread_id=thread_id, limit=5, order="desc")
+        responses = thread_messages.data[0].content[0].text.value
+
         return responses
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if thread_id is not None:
+            task = asyncio.get_running_loop().create_task(deleteThread(thread_id, None if finished else run_id))
+            cleanup_tasks.add(task)
+            task.add_done_callback(cleanup_tasks.discard)
 
 
 # Update the model to directly reflect the JSON structure
@@ -304,20 +261,28 @@ class ConvertJson(BaseModel):
 
 
 @app.post("/getAIinsights/")
-async def fetch_and_respond(payload: AIPayload , _: dict = Depends(get_current_user) ):
+async def fetch_and_respond(payload: AIPayload , user: str = Depends(get_current_user) ):
+    try:
+        run = admission.acquire(f"user:{user}")
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=str(e), headers=e.headers())
     try:
         prompt = payload.prompt
         vectorStoreID = payload.vectorStoreID
         AssistantID = payload.AssistantID
 
 
-        AI_insights = getAssistantResponse(prompt ,AssistantID ,  vectorStoreID)
+        AI_insights = await getAssistantResponse(prompt ,AssistantID ,  vectorStoreID)
         
         print("Assistant:", AI_insights)
 
         return  {"ai_insights":AI_insights}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        run.release()
 
 
 @app.post("/convertToJson/")
@@ -328,75 +293,44 @@ async def convert_to_json(payload: ConvertJson ,  _: dict = Depends(get_current_
         if not assistant_response.strip():
             print("Error: assistant_response is empty.")
             return {"error": "Empty response"}
-        # Initialize an empty dictionary to hold the parsed data
-        response_json = {
-            "summary": None,
-            "medications": [],
-            "risk profile": None,
-            "consultation_needed": None
-        }
-        def clean_text(text):
-            return re.sub(r'[^A-Za-z0-9\s]', '', text).strip()
-        # Define regex patterns to match each part of the response
-        summary_pattern = r"(?i)summary[:\-\s\*#]*([^\*\#]*?)(?=\n|$)"
-        medications_pattern = r"(?i)suggested\s+medications[:\-\s\*#]*([\s\S]*?)(?=###|risk|immediate|$)"
-        risk_pattern = r"(?i)(risk\s+profile|risk)[:\-\s\*#]*([^\*\#]*?)(?=\n|$)"
-        consultation_pattern = r"(?i)immediate\s+consultation\s+needed[:\-\s\*#]*([^\*\#]*?)(?=\n|$)"
-        # Extract summary
-        summary_match = re.search(summary_pattern, assistant_response, re.DOTALL)
-        if summary_match:
-            response_json["summary"] = clean_text(summary_match.group(1).strip())
-        # Extract medications as list items, handling bullet points
-        medications_match = re.search(medications_pattern, assistant_response, re.DOTALL)
-        if medications_match:
-            medications_text = medications_match.group(1).strip()
-            medications = re.split(r'\s*\d+\.\s*|\n|,\s*', medications_text)
-            response_json["medications"] = [clean_text(med) for med in medications if clean_text(med)]
-        # Extract and validate risk profile
-        risk_match = re.search(risk_pattern, assistant_response, re.DOTALL)
-        if risk_match:
-            risk_value = clean_text(risk_match.group(2)).lower()
-            if "low" in risk_value:
-                response_json["risk profile"] = "Low Risk"
-            elif "moderate" in risk_value:
-                response_json["risk profile"] = "Moderate Risk"
-            elif "high" in risk_value:
-                response_json["risk profile"] = "High Risk"
-            elif "medium" in risk_value:
-                response_json["risk profile"] = "Medium Risk"
-            else:
-                response_json["risk profile"] = "None"
-                
-        # Extract and validate consultation needed (Yes/No only)
-        consultation_match = re.search(consultation_pattern, assistant_response, re.DOTALL)
-        if consultation_match:
-            consultation_value = clean_text(consultation_match.group(1)).lower()
-            if "yes" in consultation_value:
-                response_json["consultation_needed"] = "Yes"
-            elif "no" in consultation_value:
-                response_json["consultation_needed"] = "No"
-        return response_json 
+        # JSON first, then the precompiled regex extractors, for either schema
+        return insight_normalizer.normalize(assistant_response).response()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 
+# Records of the last lastNDays days (15 by default, 0 for the whole
+# history), or those between since and until (ISO 8601)
 @app.post("/getPrompts/")
-async def getPromptsdata(payload: RequestPayload ,  _: dict = Depends(get_current_user)):
+async def getPromptsdata(payload: RequestPayload ,  _: dict = Depends(get_current_user),
+                         since: Optional[str] = None, until: Optional[str] = None, lastNDays: int = 15):
     try:
         print("User authenticated successfully")
 
-        prompts = extractData(payload.dict())
+        prompts = extractData(payload.dict(), since, until, lastNDays)
 
         if not prompts:
             return {"error": "No data extracted from jsonResponse"}
 
         print("Prompt",prompts) 
         return {"prompt": prompts}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/authStats/")
+async def authStats(_: dict = Depends(get_current_user)):
+    return {**token_cache.stats(), "keys": key_ring.describe()}
+
+
+@app.get("/admissionStats/")
+async def admissionStats(_: dict = Depends(get_current_user)):
+    return admission.stats()
+
+
 @app.get("/")
 async def healthCheck():
     try:
@@ -0,0 +1,115 @@
+import json
+import os
+import secrets
+import threading
+import time
+
+import jwt
+
+
+class KeyRing:
+    """Signing keys of the JWT service, shared by every worker and node.
+
+    Keys come from a JSON document of the form
+    ``{"active": "<kid>", "keys": {"<kid>": "<secret>", ...}}``, read from a
+    file (re-read when it changes) or given inline. New tokens are signed
+    with the active key and carry its ``kid`` header; tokens are verified
+    with the key their ``kid`` names, so any key still listed keeps working.
+    Rotation: add the new key, promote it to active once every node has it,
+    and drop the old one after its tokens have expired.
+    """
+
+    def __init__(self, keys, active, algorithm="HS256", path=None, reload_interval=5.0, on_change=None):
+        self.algorithm = algorithm
+        self.path = path
+        self.reload_interval = reload_interval
+        # Called after keys were removed or replaced, so claims verified with
+        # them can be dropped
+        self.on_change = on_change
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._checked = time.monotonic()
+        self._set(keys, active)
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        keys, active = cls._parse(path, open(path).read())
+        ring = cls(keys, active, path=path, **kwargs)
+        ring._mtime = os.stat(path).st_mtime
+        return ring
+
+    @classmethod
+    def from_json(cls, text, **kwargs):
+        return cls(*cls._parse("JWT_KEYS", text), **kwargs)
+
+    @classmethod
+    def from_env(cls, **kwargs):
+        # JWT_KEYS_FILE, then JWT_KEYS, then a single SECRET_KEY. Without any
+        # of them a random key is generated, which only works for one process.
+        if os.getenv("JWT_KEYS_FILE"):
+            return cls.from_file(os.getenv("JWT_KEYS_FILE"), **kwargs)
+        if os.getenv("JWT_KEYS"):
+            return cls.from_json(os.getenv("JWT_KEYS"), **kwargs)
+        if os.getenv("SECRET_KEY"):
+            return cls({"default": os.getenv("SECRET_KEY")}, "default", **kwargs)
+        print("Warning: no JWT_KEYS_FILE, JWT_KEYS or SECRET_KEY set, tokens are only valid in this process")
+        return cls({"local": secrets.token_urlsafe(32)}, "local", **kwargs)
+
+    @staticmethod
+    def _parse(source, text):
+        config = json.loads(text)
+        keys, active = config.get("keys"), config.get("active")
+        if not isinstance(keys, dict) or not keys or not all(isinstance(key, str) and key for key in keys.values()):
+            raise ValueError(f"{source}: 'keys' must map each kid to a non-empty secret")
+        if active not in keys:
+            raise ValueError(f"{source}: active kid '{active}' is not one of the keys")
+        return keys, active
+
+    def _set(self, keys, active):
+        self._keys = dict(keys)
+        self.active = active
+
+    @property
+    def kids(self):
+        return list(self._keys)
+
+    def encode(self, payload):
+        return jwt.encode(payload, self._keys[self.active], algorithm=self.algorithm, headers={"kid": self.active})
+
+    def decode(self, token):
+        kid = jwt.get_unverified_header(token).get("kid")
+        if kid is None:
+            # Tokens issued before key ids were added
+            key = self._keys.get("default")
+        else:
+            key = self._keys.get(kid)
+        if key is None:
+            raise jwt.InvalidTokenError(f"Unknown signing key '{kid}'")
+        return jwt.decode(token, key, algorithms=[self.algorithm])
+
+    def refresh(self):
+        # Re-reads the key file if it changed, at most every reload_interval
+        # seconds. A file that fails to parse leaves the current keys in use.
+        if self.path is None or time.monotonic() - self._checked < self.reload_interval:
+            return False
+        with self._lock:
+            if time.monotonic() - self._checked < self.reload_interval:
+                return False
+            self._checked = time.monotonic()
+            try:
+                mtime = os.stat(self.path).st_mtime
+                if mtime == self._mtime:
+                    return False
+                keys, active = self._parse(self.path, open(self.path).read())
+            except (OSError, ValueError) as e:
+                print(f"Error reloading JWT keys from {self.path}: {e}")
+                return False
+            self._mtime = mtime
+            retired = any(self._keys[kid] != keys.get(kid) for kid in self._keys)
+            self._set(keys, active)
+        if retired and self.on_change:
+            self.on_change()
+        return True
+
+    def describe(self):
+        return {"active": self.active, "kids": self.kids, "algorithm": self.algorithm}
@@ -0,0 +1,262 @@
+import asyncio
+import json
+import math
+import os
+import random
+import uuid
+from types import SimpleNamespace
+
+
+# Every prompt carries the whole history it needs, so runs on a reused thread
+# only read the new message. Earlier turns are neither billed again nor able
+# to change the answer, which keeps answers cacheable without the thread key.
+REUSED_THREAD_TRUNCATION = {"type": "last_messages", "last_messages": 1}
+
+
+class OpenAIAssistantsBackend:
+    """Runs prompts on the OpenAI Assistants API."""
+
+    name = "openai"
+
+    def __init__(self, api_key=None):
+        from openai import AsyncOpenAI
+
+        self.client = AsyncOpenAI(api_key=api_key or os.getenv("OPENAI_API_KEY"))
+
+    async def start_run(self, thread_id, prompt, assistant_id, vector_store_id, instructions, response_format=None):
+        # Without a thread, create_and_run makes thread and run in one call
+        if thread_id is None:
+            return await self.client.beta.threads.create_and_run(
+                instructions=instructions,
+                assistant_id=assistant_id,
+                thread={
+                    "messages": [{"role": "user", "content": prompt}],
+                    # "tool_resources": {"file_search": {"vector_store_ids": vector_store_id}},
+                },
+                **self._run_options(response_format),
+                extra_headers={"OpenAI-Beta": "assistants=v2"}
+            )
+        return await self.client.beta.threads.runs.create(
+            thread_id=thread_id,
+            assistant_id=assistant_id,
+            instructions=instructions,
+            additional_messages=[{"role": "user", "content": prompt}],
+            truncation_strategy=REUSED_THREAD_TRUNCATION,
+            **self._run_options(response_format),
+            extra_headers={"OpenAI-Beta": "assistants=v2"}
+        )
+
+    async def retrieve_run(self, thread_id, run_id):
+        return await self.client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run_id)
+
+    async def fetch_message(self, thread_id):
+        thread_messages = await self.client.beta.threads.messages.list(thread_id=thread_id, limit=5, order="desc")
+        return thread_messages.data[0].content[0].text.value
+
+    async def stream_run(self, thread_id, prompt, assistant_id, vector_store_id, instructions, response_format=None):
+        # Yields ("thread", thread_id), then ("delta", text) pieces, then
+        # ("completed", None). Raises if the run does not complete.
+        if thread_id is None:
+            stream = await self.client.beta.threads.create_and_run(
+                instructions=instructions,
+                assistant_id=assistant_id,
+                thread={
+                    "messages": [{"role": "user", "content": prompt}],
+                    # "tool_resources": {"file_search": {"vector_store_ids": vector_store_id}},
+                },
+                stream=True,
+                **self._run_options(response_format),
+                extra_headers={"OpenAI-Beta": "assistants=v2"}
+            )
+        else:
+            stream = await self.client.beta.threads.runs.create(
+                thread_id=thread_id,
+                assistant_id=assistant_id,
+                instructions=instructions,
+                additional_messages=[{"role": "user", "content": prompt}],
+                truncation_strategy=REUSED_THREAD_TRUNCATION,
+                stream=True,
+                **self._run_options(response_format),
+                extra_headers={"OpenAI-Beta": "assistants=v2"}
+            )
+        async with stream:
+            async for event in stream:
+                if event.event == "thread.run.created":
+                    yield "thread", event.data.thread_id
+                elif event.event == "thread.message.delta":
+                    for part in event.data.delta.content or []:
+                        if part.type == "text" and part.text and part.text.value:
+                            yield "delta", part.text.value
+                elif event.event == "thread.run.completed":
+                    yield "completed", None
+                elif event.event in ("thread.run.failed", "thread.run.expired", "thread.run.cancelled"):
+                    raise Exception(f"Assistant run ended with status '{event.data.status}'")
+                elif event.event == "error":
+                    raise Exception(str(event.data))
+
+    async def cancel_run(self, thread_id, run_id):
+        await self.client.beta.threads.runs.cancel(thread_id=thread_id, run_id=run_id)
+
+    async def delete_thread(self, thread_id):
+        await self.client.beta.threads.delete(thread_id)
+
+    @staticmethod
+    def _run_options(response_format):
+        # Leaves the assistant's own response format in place when None
+        return {"response_format": response_format} if response_format else {}
+
+
+DEFAULT_STUB_ANSWER = json.dumps({
+    "Summary": "The resident reports recurring symptoms of moderate severity that have stayed broadly stable over the logged period.",
+    "AI-Recommended Next Steps": [
+        "Keep logging symptoms daily so changes can be spotted early.",
+        "Review the current care plan with the attending physician.",
+        "Maintain regular hydration, sleep and light physical activity."
+    ]
+})
+
+
+class StubBackend:
+    """Offline stand-in for the Assistants API, for load and capacity tests.
+
+    Runs finish after a latency drawn from the configured distribution and
+    either complete with one of the canned answers or end in a failure
+    status. No network calls are made and nothing is billed.
+    """
+
+    name = "stub"
+
+    def __init__(self, latency_dist="lognormal", latency_mean=3.0, latency_spread=0.5,
+                 failure_rate=0.0, expire_rate=0.0, api_latency=0.05, answers=None, seed=None):
+        self.latency_dist = latency_dist
+        self.latency_mean = latency_mean
+        self.latency_spread = latency_spread
+        self.failure_rate = failure_rate
+        self.expire_rate = expire_rate
+        # Round-trip time of a single simulated API call
+        self.api_latency = api_latency
+        self.answers = answers or [DEFAULT_STUB_ANSWER]
+        self._random = random.Random(seed)
+        self._runs = {}
+        self.api_calls = 0
+
+    @classmethod
+    def from_env(cls):
+        answers = None
+        answers_file = os.getenv("STUB_ANSWERS_FILE")
+        if answers_file:
+            with open(answers_file) as f:
+                # A JSON list of answers; objects are sent back as JSON text
+                answers = [a if isinstance(a, str) else json.dumps(a) for a in json.load(f)]
+        seed = os.getenv("STUB_SEED")
+        return cls(
+            latency_dist=os.getenv("STUB_LATENCY_DIST", "lognormal"),
+            latency_mean=float(os.getenv("STUB_LATENCY_MEAN", 3.0)),
+            latency_spread=float(os.getenv("STUB_LATENCY_SPREAD", 0.5)),
+            failure_rate=float(os.getenv("STUB_FAILURE_RATE", 0.0)),
+            expire_rate=float(os.getenv("STUB_EXPIRE_RATE", 0.0)),
+            api_latency=float(os.getenv("STUB_API_LATENCY", 0.05)),
+            answers=answers,
+            seed=int(seed) if seed else None,
+        )
+
+    def sample_latency(self):
+        mean, spread = self.latency_mean, self.latency_spread
+        if self.latency_dist == "fixed":
+            return mean
+        if self.latency_dist == "uniform":
+            return max(0.0, self._random.uniform(mean - spread, mean + spread))
+        if self.latency_dist == "exponential":
+            return self._random.expovariate(1.0 / mean) if mean > 0 else 0.0
+        if self.latency_dist == "lognormal":
+            # spread is the sigma of the underlying normal; mu keeps the mean at latency_mean
+            if mean <= 0:
+                return 0.0
+            return self._random.lognormvariate(math.log(mean) - spread ** 2 / 2, spread)
+        raise ValueError(f"Unknown stub latency distribution '{self.latency_dist}'")
+
+    async def start_run(self, thread_id, prompt, assistant_id, vector_store_id, instructions, response_format=None):
+        # The canned answers stand in for schema-conforming output, so
+        # response_format is accepted and ignored
+        await self._api_call()
+        thread_id = thread_id or f"thread_stub_{uuid.uuid4().hex[:20]}"
+        run_id = f"run_stub_{uuid.uuid4().hex[:20]}"
+        roll = self._random.random()
+        if roll < self.failure_rate:
+            outcome = "failed"
+        elif roll < self.failure_rate + self.expire_rate:
+            outcome = "expired"
+        else:
+            outcome = "completed"
+        loop = asyncio.get_running_loop()
+        self._runs[run_id] = SimpleNamespace(
+            thread_id=thread_id,
+            finish_at=loop.time() + self.sample_latency(),
+            outcome=outcome,
+            answer=self._random.choice(self.answers),
+        )
+        return SimpleNamespace(id=run_id, thread_id=thread_id, status="queued")
+
+    async def retrieve_run(self, thread_id, run_id):
+        await self._api_call()
+        run = self._runs.get(run_id)
+        if run is None:
+            raise Exception(f"No run found with id '{run_id}'")
+        if asyncio.get_running_loop().time() < run.finish_at:
+            return SimpleNamespace(id=run_id, thread_id=thread_id, status="in_progress", last_error=None)
+        last_error = None
+        if run.outcome != "completed":
+            # Nobody fetches a message for a failed run, so forget it now
+            del self._runs[run_id]
+        if run.outcome == "failed":
+            last_error = SimpleNamespace(code="server_error", message="Simulated failure from the stub backend")
+        return SimpleNamespace(id=run_id, thread_id=thread_id, status=run.outcome, last_error=last_error)
+
+    async def fetch_message(self, thread_id):
+        await self._api_call()
+        for run_id, run in reversed(list(self._runs.items())):
+            if run.thread_id == thread_id and run.outcome == "completed":
+                del self._runs[run_id]
+                return run.answer
+        raise Exception(f"No completed run on thread '{thread_id}'")
+
+    async def stream_run(self, thread_id, prompt, assistant_id, vector_store_id, instructions, response_format=None):
+        run = await self.start_run(thread_id, prompt, assistant_id, vector_store_id, instructions, response_format)
+        state = self._runs.pop(run.id)
+        yield "thread", run.thread_id
+        latency = max(0.0, state.finish_at - asyncio.get_running_loop().time())
+        if state.outcome != "completed":
+            await asyncio.sleep(latency)
+            raise Exception(f"Assistant run ended with status '{state.outcome}'")
+        # Spread the answer over the run time in small chunks, like token deltas
+        chunks = [state.answer[i:i + 16] for i in range(0, len(state.answer), 16)] or [""]
+        delay = latency / len(chunks)
+        for chunk in chunks:
+            await asyncio.sleep(delay)
+            yield "delta", chunk
+        yield "completed", None
+
+    async def cancel_run(self, thread_id, run_id):
+        await self._api_call()
+        self._runs.pop(run_id, None)
+
+    async def delete_thread(self, thread_id):
+        await self._api_call()
+
+    async def _api_call(self):
+        self.api_calls += 1
+        if self.api_latency > 0:
+            await asyncio.sleep(self.api_latency)
+
+
+BACKENDS = {
+    OpenAIAssistantsBackend.name: OpenAIAssistantsBackend,
+    StubBackend.name: StubBackend.from_env,
+}
+
+
+def create_backend(name=None):
+    name = (name or os.getenv("LLM_BACKEND", "openai")).lower()
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown LLM_BACKEND '{name}', expected one of: {', '.join(BACKENDS)}")
+    return BACKENDS[name]()
@@ -1,146 +1,140 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from pydantic import BaseModel, ConfigDict, Field, TypeAdapter, ValidationError
 import os
 import uvicorn
 import time
-from openai import OpenAI
+import asyncio
 import requests
 from dotenv import load_dotenv
+from run_poller import RunPoller, RunPollTimeout
+from insight_cache import InsightCache, make_cache_key
+from thread_leases import ThreadLeaseManager
+from single_flight import SingleFlight
+from job_queue import JobQueue
+from llm_backends import create_backend
+from prompt_compaction import estimate_tokens
+from prompt_templates import PromptTemplateRegistry, render_sections
+from prompt_state import PromptStateStore
+from symptom_index import SymptomIndex
+from symptom_logs import collectSymptomLogs, parseRecordTimestamp, parseTimestampsBulk, recordSymptoms, windowedPayload
+from symptom_store import SymptomStore
+from insight_parsing import INSIGHTS_RESPONSE_FORMAT, InsightParseError, StreamingInsightParser, parse_insights_json
+from insight_normalizer import InsightNormalizer
+from response_encoding import CompressionMiddleware, CompressionStats, FastJSONResponse, encode_stats
+from admission import Admission, AdmissionController, AdmissionRejected
 import json
 import re
+import hashlib
+from contextlib import nullcontext
 from typing import Dict, Any 
-from datetime import datetime
-from typing import Optional
+from typing import Optional, Union
+from typing_extensions import NotRequired, TypedDict
 
 
 load_dotenv()
-client = OpenAI()
-app = FastAPI()
-thread_cache = {}
-client.api_key = os.getenv("OPENAI_API_KEY")
-
-
-def extractData(apiResponse):
+# orjson-rendered JSON for every endpoint, compressed (brotli or gzip, per
+# Accept-Encoding) once the body reaches RESPONSE_COMPRESS_MIN_SIZE bytes
+app = FastAPI(default_response_class=FastJSONResponse)
+compression_stats = CompressionStats()
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=int(os.getenv("RESPONSE_COMPRESS_MIN_SIZE", 1024)),
+    stats=compression_stats,
+)
+# LLM_BACKEND=stub swaps the Assistants API for an offline simulator
+llm_backend = create_backend()
+run_poller = RunPoller(llm_backend.retrieve_run)
+insight_cache = InsightCache(
+    max_entries=int(os.getenv("INSIGHT_CACHE_SIZE", 1024)),
+    ttl=int(os.getenv("INSIGHT_CACHE_TTL", 6 * 3600)),
+    db_path=os.getenv("INSIGHT_CACHE_DB") or None,
+)
+thread_leases = ThreadLeaseManager(
+    max_threads=int(os.getenv("MAX_ACTIVE_THREADS", 100)),
+    idle_ttl=int(os.getenv("THREAD_IDLE_TTL", 900)),
+    delete_thread=llm_backend.delete_thread,
+    cancel_run=llm_backend.cancel_run,
+)
+# SINGLE_FLIGHT_RECENT_TTL > 0 also hands out results finished that many seconds ago
+single_flight = SingleFlight(recent_ttl=float(os.getenv("SINGLE_FLIGHT_RECENT_TTL", 0)))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", 32))
+insight_normalizer = InsightNormalizer()
+# Per-client limits on assistant runs: ADMISSION_RATE runs per second with
+# bursts of ADMISSION_BURST, at most ADMISSION_MAX_CONCURRENT at a time. Only
+# runs that are actually started count; cache hits and joined runs do not.
+# Clients are told apart by X-API-Key if it is one of the comma-separated
+# ADMISSION_API_KEYS, or else by IP address.
+admission = AdmissionController(
+    rate=float(os.getenv("ADMISSION_RATE", 2)),
+    burst=int(os.getenv("ADMISSION_BURST", 20)),
+    max_concurrent=int(os.getenv("ADMISSION_MAX_CONCURRENT", 8)),
+)
+ADMISSION_API_KEYS = {
+    hashlib.sha256(key.strip().encode("utf-8")).hexdigest()
+    for key in os.getenv("ADMISSION_API_KEYS", "").split(",")
+    if key.strip()
+}
+TRUST_FORWARDED_FOR = os.getenv("TRUST_FORWARDED_FOR", "0") == "1"
+# Jobs wait up to JOB_RUN_TIMEOUT seconds for their run instead of the 20 s
+# of the interactive endpoints; the lease outlasts that wait
+JOB_RUN_TIMEOUT = float(os.getenv("JOB_RUN_TIMEOUT", 600))
+job_queue = JobQueue(
+    os.getenv("JOB_DB_PATH", "jobs.db"),
+    lambda job: runInsightJob(job),
+    workers=int(os.getenv("JOB_WORKERS", 4)),
+    lease_seconds=JOB_RUN_TIMEOUT + 60,
+)
+
+
+# Prompt formats, compiled once at startup. PROMPT_TEMPLATES_FILE can add
+# formats or override the built-in ones without code changes.
+prompt_templates = PromptTemplateRegistry()
+if os.getenv("PROMPT_TEMPLATES_FILE"):
+    prompt_templates.load_file(os.getenv("PROMPT_TEMPLATES_FILE"))
+DEFAULT_PROMPT_FORMAT = os.getenv("PROMPT_FORMAT", "full")
+
+
+# Template for a request: promptFormat if given, else the compact or the
+# default format. Unknown names are a client error.
+def promptTemplate(prompt_format=None, compact=False):
+    name = prompt_format or ("compact" if compact else DEFAULT_PROMPT_FORMAT)
+    template = prompt_templates.get(name)
+    if template is None:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown prompt format '{name}', expected one of: {', '.join(prompt_templates.names())}",
+        )
+    return template
+
+
+# Yields the prompt section by section. Each section is assembled in a list
+# and joined once, so building the prompt stays linear in the number of logs.
+# The compact format replaces the verbatim history with per-symptom summaries
+# plus the most recent recent_logs logs per disease, shrunk to fit token_budget.
+def iterPromptSections(apiResponse, compact=False, token_budget=None, recent_logs=3, template=None):
+    template = template or promptTemplate(compact=compact)
+    resident, extracted_data, common_symptoms = collectSymptomLogs(apiResponse)
+    yield from render_sections(template, resident, extracted_data, common_symptoms, token_budget, recent_logs)
+
+
+def extractData(apiResponse, compact=False, token_budget=None, recent_logs=3, template=None):
     try:
-        # Retrieve resident details
-        resident = apiResponse.get("resident", {})
-        name = resident.get("name", "Unknown")
-        age = resident.get("age")
-        gender = resident.get("gender")
-
-        diseases_data = apiResponse.get("diseases", [])
-        extracted_data = []
-        common_symptoms = {}
-
-        # Iterate over each disease in the diseases list
-        for disease in diseases_data:
-            ds_name = disease.get("ds_name")
-            records = disease.get("records", [])
-
-            disease_details = []
-
-            for record in records:
-                record_date_str = record.get("updatedAt")
-                if not record_date_str:
-                    continue
-
-                # Parse the ISO 8601 date format with UTC timezone
-                try:
-                    record_date = datetime.fromisoformat(record_date_str.replace("Z", "+00:00"))
-                except ValueError:
-                    continue
-
-                symptoms_list = record.get("symptoms", [])
-                log_time = record_date.strftime("%I:%M %p")
-                log_date = record_date.strftime("%d %B %Y")
-
-                symptoms = {
-                    symptom.get("title"): round(symptom.get("value"), 2)
-                    for symptom in symptoms_list
-                    if symptom.get('value', 0) > 0
-                }
-
-                # Store the detailed log for the disease
-                if symptoms:
-                    disease_details.append({
-                        "date": log_date,
-                        "time": log_time,
-                        "symptoms": symptoms
-                    })
-
-                    # Add to common symptoms
-                    for title, value in symptoms.items():
-                        if title not in common_symptoms:
-                            common_symptoms[title] = []
-                        common_symptoms[title].append((log_date, log_time, value))
-
-            if disease_details:
-                extracted_data.append((ds_name, disease_details))
-
-        # If no data found
-        if not extracted_data:
-            personal_info = f"Personal Information: Name: {name}."
-            if age is not None:
-                personal_info += f" Age: {age}."
-            if gender is not None:
-                personal_info += f" Gender: {gender}."
-            return (
-                f"{personal_info}\nThere is no disease or symptom recorded recently."
-            )
-
-        # Construct the prompt for available data
-        prompt = f"Personal Information: Name: {name}."
-        if age is not None:
-            prompt += f" Age: {age}."
-        if gender is not None:
-            prompt += f" Gender: {gender}."
-        prompt += "\nMedical History and Symptoms:"
-
-        for idx, (ds_name, details) in enumerate(extracted_data, 1):
-            prompt += f"\n{idx}. {ds_name}, Date of Diagnosis: {details[0]['date']} at {details[0]['time']} with multiple symptom logs."
-            for log in details:
-                log_date = log["date"]
-                log_time = log["time"]
-                symptoms = ", ".join([f"{key}: {value}/10" for key, value in log["symptoms"].items()])
-                prompt += f"\nSymptom Log at {log_date}, {log_time}: {symptoms}."
-
-        # Add common symptoms over time
-        if common_symptoms:
-            prompt += "\n\nCommon Symptoms Logged Over Time:"
-            for title, occurrences in common_symptoms.items():
-                for log_date, log_time, value in occurrences:
-                    prompt += f"\n{log_date}, {log_time}: {title}: {value}/10."
-
-        # Add the request
-        prompt += "\n\nRequest: Provide guidance or recommendations for medication based on the above symptoms and conditions."
-
-        return prompt
+        return "".join(iterPromptSections(apiResponse, compact, token_budget, recent_logs, template))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
 
 
-# Function to interact with assistant and get a response for each prompt
-def getAssistantResponse(prompt, assistant_id, vector_store_id, max_retries=10, retry_delay=2):
-    try:
-        # responses = []
-        # Iterate through each prompt and get a response
-        thread_id = thread_cache.get(assistant_id)
-        
-        # Check if thread exists; if completed, reset it
-        if thread_id:
-            try:
-                run_response = client.beta.threads.get(thread_id=thread_id)
-                if run_response["status"] == "completed":
-                    thread_cache.pop(assistant_id, None)
-                    thread_id = None
-            except Exception:
-                thread_cache.pop(assistant_id, None)
-                thread_id = None
-        
-        # Create a new thread if no valid one exists
-        if not thread_id:
-            response = client.beta.threads.create_and_run(
-                instructions='''Response Format Restriction: Always provide insights in the exact JSON format as shown below, and do not include any additional information or explanation.\n
+prompt_states = PromptStateStore(
+    parse_timestamp=parseRecordTimestamp,
+    record_symptoms=recordSymptoms,
+    max_residents=int(os.getenv("PROMPT_STATE_MAX_RESIDENTS", 1000)),
+)
+
+
+ASSISTANT_INSTRUCTIONS = '''Response Format Restriction: Always provide insights in the exact JSON format as shown below, and do not include any additional information or explanation.\n
                 {
                     "Summary": "overview of current condition in 200 words strictly without repeating the same and also do not repeat the scores",
                     "AI-Recommended Next Steps": Provide a minimum of 3 and a maximum of 10 recommendations, formatted as a bullet-point list.,
@@ -167,48 +161,182 @@ def getAssistantResponse(prompt, assistant_id, vector_store_id, max_retries=10,
                     "Summary": "Insufficient data to provide an accurate overview.",
                     "AI-Recommended Next Steps:" : "Insufficient data to provide an accurate overview."
                     
-                }''',
-                assistant_id=assistant_id,
-                thread={
-                    "messages": [{"role": "user", "content": prompt}],
-                    # "tool_resources": {"file_search": {"vector_store_ids": vector_store_id}},
-                },
-                extra_headers={"OpenAI-Beta": "assistants=v2"} 
-            )
-            thread_id = response.thread_id
-            thread_cache[assistant_id] = thread_id
-            run_id = response.id
-        else:
-            # Use the existing thread
-            run_response = client.beta.threads.runs.create(
-                thread_id=thread_id, messages=[{"role": "user", "content": prompt}]
-            )
-            run_id = run_response.id
-
-        # Retry loop to check for completion
-        retries = 0
-        while retries < max_retries:
-            run_status = client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run_id)
-            if run_status.status == "completed":
-                # Retrieve the last message in the thread
-                thread_messages = client.beta.threads.messages.list(thread_id=thread_id, limit=5, order="desc")
-                responses  = thread_messages.data[0].content[0].text.value
-                # responses.append(response_content)
-                break  # Exit retry loop on success
-            time.sleep(retry_delay)
-            retries += 1
-        else:
-            responses = ("The assistant did not respond in time for this prompt. Please try again.")
-        
+                }'''
+# ASSISTANT_STRUCTURED_OUTPUT=1 sends a strict JSON schema for the Summary /
+# AI-Recommended Next Steps answer, so the model cannot wrap it in prose or
+# fences. Off by default: the Assistants API rejects it for assistants with
+# file_search or other non-function tools and for models without structured
+# output support, and the tolerant parser handles the instructions alone.
+ASSISTANT_RESPONSE_FORMAT = INSIGHTS_RESPONSE_FORMAT if os.getenv("ASSISTANT_STRUCTURED_OUTPUT", "0") == "1" else None
+# Part of the insight cache key, so changing the instructions or the response
+# format invalidates old answers
+INSTRUCTIONS_VERSION = hashlib.sha256(
+    (ASSISTANT_INSTRUCTIONS + json.dumps(ASSISTANT_RESPONSE_FORMAT, sort_keys=True)).encode("utf-8")
+).hexdigest()[:12]
+ASSISTANT_TIMEOUT_MESSAGE = "The assistant did not respond in time for this prompt. Please try again."
+
+
+# Non-blocking assistant call used by the API endpoints. Every await hands the
+# event loop back to uvicorn, so a single worker can keep many runs in flight
+# while the other endpoints stay responsive. thread_key (e.g. a resident id)
+# selects a per-resident thread; without it the request gets its own thread.
+# timeout, in seconds, overrides max_retries * retry_delay.
+async def getAssistantResponseAsync(prompt, assistant_id, vector_store_id, max_retries=10, retry_delay=2, thread_key=None,
+                                    timeout=None):
+    lease = await thread_leases.acquire(thread_key)
+    finished = False
+    try:
+        response = await llm_backend.start_run(
+            lease.thread_id, prompt, assistant_id, vector_store_id, ASSISTANT_INSTRUCTIONS, ASSISTANT_RESPONSE_FORMAT
+        )
+        lease.thread_id = response.thread_id
+        run_id = lease.run_id = response.id
+
+        # Wait on the shared poller instead of sleeping in this request
+        try:
+            run_status = await run_poller.wait(lease.thread_id, run_id, timeout=timeout or max_retries * retry_delay)
+        except RunPollTimeout:
+            return ASSISTANT_TIMEOUT_MESSAGE
+
+        if run_status.status != "completed":
+            detail = f"Assistant run ended with status '{run_status.status}'"
+            if getattr(run_status, "last_error", None):
+                detail += f": {run_status.last_error.message}"
+            raise HTTPException(status_code=502, detail=detail)
+        finished = True
+
+        # Retrieve the last message in the thread
+        responses = await llm_backend.fetch_message(lease.thread_id)
+
         return responses
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        thread_leases.release(lease, discard=not finished)
+
+
+# Streams the assistant answer as it is generated instead of polling the run
+# and fetching the final message afterwards. Yields text deltas; raises if the
+# run ends in a non-completed state.
+async def streamAssistantResponse(prompt, assistant_id, vector_store_id, thread_key=None):
+    lease = await thread_leases.acquire(thread_key)
+    finished = False
+    try:
+        events = llm_backend.stream_run(
+            lease.thread_id, prompt, assistant_id, vector_store_id, ASSISTANT_INSTRUCTIONS, ASSISTANT_RESPONSE_FORMAT
+        )
+        async for kind, value in events:
+            if kind == "thread":
+                lease.thread_id = value
+            elif kind == "delta":
+                yield value
+            elif kind == "completed":
+                finished = True
+    finally:
+        thread_leases.release(lease, discard=not finished)
+
+
+def formatSSE(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+# Identical prompts for the same assistant and instructions get the same
+# answer from the cache instead of a new run, and identical requests arriving
+# while a run is in flight wait for that run instead of starting their own.
+# Only a new run is charged to client's admission limits: it raises
+# AdmissionRejected, or with wait_admission waits until the run fits.
+# Returns (ai_insights, cached).
+async def generateInsight(prompt, assistant_id, vector_store_id, use_cache=True, thread_key=None, timeout=None,
+                          client=None, wait_admission=False):
+    cache_key = make_cache_key(assistant_id, INSTRUCTIONS_VERSION, prompt)
+    if use_cache:
+        cached = insight_cache.get(cache_key)
+        if cached is not None:
+            return cached, True
+
+    # The caller is admitted before a run is started for it, so a rejection
+    # or wait only ever reaches the client it belongs to. Joining a run that
+    # is in flight already is free.
+    if client is None or single_flight.joinable(cache_key):
+        admitted = nullcontext()
+    elif wait_admission:
+        admitted = await admission.wait(client)
+    else:
+        admitted = admission.acquire(client)
+
+    async def run():
+        nonlocal admitted
+        # The run owns the admission from here on
+        owned, admitted = admitted, nullcontext()
+        with owned:
+            ai_insights = await getAssistantResponseAsync(prompt, assistant_id, vector_store_id, thread_key=thread_key,
+                                                          timeout=timeout)
+        # Answers without a JSON object are not cached, so the next request
+        # gets a fresh run instead of the same unusable text
+        if ai_insights != ASSISTANT_TIMEOUT_MESSAGE and isParseableInsight(ai_insights):
+            insight_cache.set(cache_key, ai_insights)
+        return ai_insights
+
+    try:
+        ai_insights, shared = await single_flight.do(cache_key, run)
+    finally:
+        # Still set if another caller's run answered this one
+        if isinstance(admitted, Admission):
+            admitted.release()
+    return ai_insights, False
+
+
+def isParseableInsight(ai_insights):
+    try:
+        parse_insights_json(ai_insights)
+    except InsightParseError:
+        return False
+    return True
+
+
+# Reads the assistant's answer in either instruction schema. Plain JSON is
+# the normal case with structured output; fenced, embedded or slightly broken
+# JSON and JSON-less answers go through the normalizer's fallbacks.
+def normalizeInsightsResult(ai_insights):
+    result = insight_normalizer.normalize(ai_insights)
+    if result.method == "none":
+        raise HTTPException(status_code=400, detail="Invalid JSON format in 'ai_insights'")
+    return result
+
+
+# Turns the assistant's answer into the response shape of /convertToJson/
+def normalizeInsights(ai_insights):
+    return normalizeInsightsResult(ai_insights).response()
+
+
+# The parsed answer next to the raw text, so clients need no /convertToJson/
+# call. An unparseable answer is reported, not raised.
+def parsedInsights(ai_insights):
+    try:
+        result = normalizeInsightsResult(ai_insights)
+    except HTTPException as e:
+        return {"insights": None, "parse_error": e.detail}
+    return {"insights": result.response(), "schema": result.schema_version, "parsed_from": result.method}
+
+
+# Worker side of /jobs/insights: one assistant call plus normalization. A
+# timeout is an error, so the queue retries the job or marks it failed.
+async def runInsightJob(job):
+    item = AIPayload(**job)
+    AI_insights, cached = await generateInsight(
+        item.prompt, item.AssistantID, item.vectorStoreID, item.useCache, item.residentID, timeout=JOB_RUN_TIMEOUT
+    )
+    if AI_insights == ASSISTANT_TIMEOUT_MESSAGE:
+        raise HTTPException(status_code=504, detail=f"Assistant run did not finish within {JOB_RUN_TIMEOUT:g} seconds")
+    return {"ai_insights": AI_insights, "cached": cached, **parsedInsights(AI_insights)}
 
 
 # Update the model to directly reflect the JSON structure
 class DiseaseRecord(BaseModel):
     recordName: str
-    _id: str
+    id: Optional[str] = Field(default=None, alias="_id")
     updatedAt: str
     symptoms: list[Dict[str, Any]]
     status: str
@@ -229,53 +357,298 @@ class RequestPayload(BaseModel):
     message: str
     resident: Resident
     diseases: list[Disease]
+    # Needed for incremental prompts, which are stored per resident
+    residentID: Optional[str] = None
+
+
 
+# Typed mirror of RequestPayload for the raw-bytes fast path. The request body
+# is validated straight from JSON into plain dicts in one pass, so the prompt
+# code reads the validated data directly instead of a model tree converted
+# back with .dict(). Unlike DiseaseRecord, symptoms are typed; int and float
+# values stay as sent so the prompt text is unchanged. Validation is strict:
+# "7", true or "81" are rejected instead of being coerced into the prompt.
+STRICT_PAYLOAD = ConfigDict(strict=True)
+
+class SymptomEntry(TypedDict, total=False):
+    __pydantic_config__ = STRICT_PAYLOAD
+    title: str
+    value: Union[int, float]
+
+class DiseaseRecordData(TypedDict):
+    __pydantic_config__ = STRICT_PAYLOAD
+    recordName: str
+    _id: NotRequired[Optional[str]]
+    updatedAt: str
+    symptoms: list[SymptomEntry]
+    status: str
+
+class DiseaseData(TypedDict):
+    __pydantic_config__ = STRICT_PAYLOAD
+    disease_id: str
+    ds_name: str
+    updatedAt: str
+    records: list[DiseaseRecordData]
+    highValueSymptoms: list[Any]
+
+class ResidentData(TypedDict):
+    __pydantic_config__ = STRICT_PAYLOAD
+    name: str
+    gender: NotRequired[Optional[str]]
+    age: NotRequired[Optional[int]]
+
+class RequestPayloadData(TypedDict):
+    __pydantic_config__ = STRICT_PAYLOAD
+    message: str
+    resident: ResidentData
+    diseases: list[DiseaseData]
+    residentID: NotRequired[Optional[str]]
+
+request_payload_adapter = TypeAdapter(RequestPayloadData)
+
+
+async def readRequestPayload(request: Request):
+    try:
+        return request_payload_adapter.validate_json(await request.body())
+    except ValidationError as e:
+        # Same 422 response FastAPI gives for a RequestPayload body
+        raise RequestValidationError(
+            [{**error, "loc": ("body", *error["loc"])} for error in e.errors(include_url=False)]
+        )
+
+
+# Documents the request body of endpoints that read it with readRequestPayload
+REQUEST_PAYLOAD_OPENAPI = {
+    "requestBody": {
+        "content": {"application/json": {"schema": request_payload_adapter.json_schema()}},
+        "required": True,
+    }
+}
 
 
 class AIPayload(BaseModel):
     prompt: str
     vectorStoreID: list[str]
     AssistantID: str
+    useCache: bool = True
+    # Optional: runs for the same resident share one thread, one at a time
+    residentID: Optional[str] = None
+
+class InsightsPayload(RequestPayload):
+    AssistantID: str
+    vectorStoreID: list[str] = []
+    useCache: bool = True
+    residentID: Optional[str] = None
+    compact: bool = False
+    tokenBudget: Optional[int] = None
+    recentLogs: int = 3
+    since: Optional[str] = None
+    until: Optional[str] = None
+    lastNDays: Optional[int] = None
+    # Name of a registered prompt template; overrides compact
+    promptFormat: Optional[str] = None
+
+class AIBatchPayload(BaseModel):
+    items: list[AIPayload]
+    concurrency: int = 8
 
 class ConvertJson(BaseModel):
     ai_insights : str
 
 
+def clientKey(request: Request):
+    # Unknown keys are ignored, or a client could get a fresh bucket per
+    # request by sending a new random key each time
+    api_key = request.headers.get("x-api-key")
+    if api_key:
+        digest = hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+        if digest in ADMISSION_API_KEYS:
+            return "key:" + digest[:16]
+    forwarded = request.headers.get("x-forwarded-for") if TRUST_FORWARDED_FOR else None
+    if forwarded:
+        return "ip:" + forwarded.split(",")[0].strip()
+    return "ip:" + (request.client.host if request.client else "unknown")
+
+
+# Refused runs get a 429 before any work is done
+@app.exception_handler(AdmissionRejected)
+async def admissionRejected(request: Request, exc: AdmissionRejected):
+    return FastJSONResponse({"detail": str(exc), "reason": exc.reason}, status_code=429, headers=exc.headers())
+
+
 @app.post("/getAIinsights/")
-async def fetch_and_respond(payload: AIPayload):
+async def fetch_and_respond(payload: AIPayload, request: Request):
     try:
         prompt = payload.prompt
         vectorStoreID = payload.vectorStoreID
         AssistantID = payload.AssistantID
 
 
-        AI_insights = getAssistantResponse(prompt ,AssistantID ,  vectorStoreID)
+        AI_insights, cached = await generateInsight(prompt ,AssistantID ,  vectorStoreID, payload.useCache, payload.residentID,
+                                                    client=clientKey(request))
         
         print("Assistant:", AI_insights)
 
-        return  {"ai_insights":AI_insights}
+        return  {"ai_insights":AI_insights, "cached": cached, **parsedInsights(AI_insights)}
+    except (HTTPException, AdmissionRejected):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
 import re
 from fastapi import HTTPException
 
-@app.post("/convertToJson/")
-async def convert_to_json(payload: ConvertJson):
-    try:
-        # Parse the JSON string inside 'ai_insights'
+# structured=true replaces the raw "delta" events with "summary" and "step"
+# events, each sent as soon as that part of the JSON answer is complete
+@app.post("/getAIinsights/stream")
+async def fetch_and_stream(payload: AIPayload, request: Request, structured: bool = False):
+    # Held until the stream ends
+    run = admission.acquire(clientKey(request))
+
+    async def event_stream():
+        chunks = []
+        parser = StreamingInsightParser()
         try:
-            insights_data = json.loads(payload.ai_insights)
-        except json.JSONDecodeError:
-            raise HTTPException(status_code=400, detail="Invalid JSON format in 'ai_insights'")
-
-        # Extract summary and recommendations
-        response_json = {
-            "summary": insights_data.get("Summary", "").strip(),
-            "AI-Recommended Next Steps": insights_data.get("AI-Recommended Next Steps", [])
+            async for delta in streamAssistantResponse(payload.prompt, payload.AssistantID, payload.vectorStoreID, payload.residentID):
+                chunks.append(delta)
+                if not structured:
+                    yield formatSSE("delta", {"text": delta})
+                    continue
+                for event, data in parser.feed(delta):
+                    yield formatSSE(event, {"text": data} if event == "summary" else data)
+            ai_insights = "".join(chunks)
+            yield formatSSE("done", {"ai_insights": ai_insights, **parsedInsights(ai_insights)})
+        except Exception as e:
+            # Headers are already sent, so failures are reported in-band
+            yield formatSSE("error", {"detail": str(e)})
+        finally:
+            run.release()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # Also covers a stream that never started
+        background=BackgroundTask(run.release),
+    )
+
+
+@app.post("/getAIinsights/batch")
+async def fetch_batch(payload: AIBatchPayload, request: Request):
+    concurrency = max(1, min(payload.concurrency, BATCH_MAX_CONCURRENCY))
+    # More parallel items than the client may run at once would only be refused
+    if admission.max_concurrent:
+        concurrency = min(concurrency, admission.max_concurrent)
+    client = clientKey(request)
+
+    async def run_item(index, item, semaphore):
+        async with semaphore:
+            try:
+                # The batch is bounded already, so an item over the client's
+                # limits waits for its turn instead of being refused
+                AI_insights, cached = await generateInsight(
+                    item.prompt, item.AssistantID, item.vectorStoreID, item.useCache, item.residentID,
+                    client=client, wait_admission=True,
+                )
+                return {
+                    "index": index,
+                    "residentID": item.residentID,
+                    "ai_insights": AI_insights,
+                    "cached": cached,
+                    **parsedInsights(AI_insights),
+                }
+            except HTTPException as e:
+                return {"index": index, "residentID": item.residentID, "error": e.detail, "status_code": e.status_code}
+            except Exception as e:
+                return {"index": index, "residentID": item.residentID, "error": str(e), "status_code": 500}
+
+    # One NDJSON line per item, in completion order; a failing item is
+    # reported on its own line and does not stop the rest of the batch
+    async def results():
+        semaphore = asyncio.Semaphore(concurrency)
+        tasks = [asyncio.create_task(run_item(index, item, semaphore)) for index, item in enumerate(payload.items)]
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                yield json.dumps(await next_result) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+
+@app.on_event("startup")
+async def startJobWorkers():
+    job_queue.start()
+
+
+@app.on_event("shutdown")
+async def stopJobWorkers():
+    await job_queue.stop()
+
+
+@app.post("/jobs/insights", status_code=202)
+async def submitInsightJob(payload: AIPayload, request: Request):
+    # Jobs run on the bounded worker pool, so only the rate applies
+    admission.acquire(clientKey(request), concurrent=False)
+    job_id = job_queue.submit(payload.dict())
+    return {"job_id": job_id, "status": "queued", "status_url": f"/jobs/{job_id}"}
+
+
+@app.get("/jobs/{job_id}")
+async def getJobStatus(job_id: str):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+# /getPrompts/, /getAIinsights/ and /convertToJson/ in one request, without
+# sending the prompt and the raw answer back and forth between them
+@app.post("/insights/")
+async def insightsPipeline(payload: InsightsPayload, request: Request):
+    try:
+        timings = {}
+        started = stage_started = time.perf_counter()
+
+        template = promptTemplate(payload.promptFormat, payload.compact)
+        data = windowedPayload(payload.dict(), payload.since, payload.until, payload.lastNDays)
+        prompt = extractData(data, token_budget=payload.tokenBudget, recent_logs=payload.recentLogs, template=template)
+        timings["prompt_ms"] = round((time.perf_counter() - stage_started) * 1000, 2)
+
+        stage_started = time.perf_counter()
+        AI_insights, cached = await generateInsight(
+            prompt, payload.AssistantID, payload.vectorStoreID, payload.useCache, payload.residentID,
+            client=clientKey(request),
+        )
+        timings["assistant_ms"] = round((time.perf_counter() - stage_started) * 1000, 2)
+        # An upstream timeout, not an answer to normalize
+        if AI_insights == ASSISTANT_TIMEOUT_MESSAGE:
+            raise HTTPException(status_code=504, detail=ASSISTANT_TIMEOUT_MESSAGE)
+
+        stage_started = time.perf_counter()
+        insights = normalizeInsights(AI_insights)
+        timings["normalize_ms"] = round((time.perf_counter() - stage_started) * 1000, 2)
+        timings["total_ms"] = round((time.perf_counter() - started) * 1000, 2)
+
+        return {
+            **insights,
+            "cached": cached,
+            "promptFormat": template.name,
+            "promptVersion": template.version,
+            "promptTokens": estimate_tokens(prompt),
+            "timings": timings,
         }
+    except (HTTPException, AdmissionRejected):
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        return response_json
+
+@app.post("/convertToJson/")
+async def convert_to_json(payload: ConvertJson):
+    try:
+        return normalizeInsights(payload.ai_insights)
 
     except HTTPException as http_exc:
         raise http_exc
@@ -433,21 +806,142 @@ async def convert_to_json(payload: ConvertJson):
 
 
 
-@app.post("/getPrompts/")
-async def getPromptsdata(payload: RequestPayload):
+@app.post("/getPrompts/", openapi_extra=REQUEST_PAYLOAD_OPENAPI)
+async def getPromptsdata(request: Request, stream: bool = False, compact: bool = False,
+                         tokenBudget: Optional[int] = None, recentLogs: int = 3, incremental: bool = False,
+                         fullSync: bool = False,
+                         since: Optional[str] = None, until: Optional[str] = None, lastNDays: Optional[int] = None,
+                         windows: Optional[list[int]] = Query(None), promptFormat: Optional[str] = None):
+    data = await readRequestPayload(request)
     try:
+        template = promptTemplate(promptFormat, compact)
+        if windows:
+            # One prompt per "last N days" window, all cut from one sorted index
+            index = SymptomIndex(data, parseTimestampsBulk)
+            prompts = {
+                str(days): extractData(index.last_days(days), token_budget=tokenBudget, recent_logs=recentLogs, template=template)
+                for days in windows
+            }
+            return {"prompts": prompts, "promptFormat": template.name, "promptVersion": template.version}
+
+        if incremental:
+            # Only records that are new or changed since the last call for this
+            # resident are processed; the payload may also carry just those.
+            # fullSync=true marks it as the complete history, so stored records
+            # missing from it are dropped. stateReset=true means nothing was
+            # stored (first call, restart, eviction or another worker), so a
+            # client that sent only a delta must resend the full history.
+            resident_id = data.get("residentID")
+            if not resident_id:
+                raise HTTPException(status_code=400, detail="residentID is required for incremental prompts")
+            if since or until or lastNDays:
+                raise HTTPException(status_code=400, detail="Time windows are not supported for incremental prompts")
+            if template.layout != "full":
+                raise HTTPException(status_code=400, detail=f"Incremental prompts are not supported for the '{template.name}' format")
+            try:
+                prompts, changed, removed, last_seen, reset = prompt_states.update(resident_id, data, template, fullSync)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            return {
+                "prompt": prompts,
+                "promptFormat": template.name,
+                "promptVersion": template.version,
+                "promptChars": len(prompts),
+                "promptTokens": estimate_tokens(prompts),
+                "changedRecords": changed,
+                "removedRecords": removed,
+                "stateReset": reset,
+                "lastSeenUpdatedAt": last_seen.isoformat() if last_seen else None,
+            }
+
+        data = windowedPayload(data, since, until, lastNDays)
+        if stream:
+            # Plain-text body written section by section as it is built
+            sections = iterPromptSections(data, token_budget=tokenBudget, recent_logs=recentLogs, template=template)
+            return StreamingResponse(
+                sections,
+                media_type="text/plain; charset=utf-8",
+                headers={"X-Prompt-Format": template.name, "X-Prompt-Version": template.version},
+            )
 
-        prompts = extractData(payload.dict())
+        prompts = extractData(data, token_budget=tokenBudget, recent_logs=recentLogs, template=template)
 
         if not prompts:
             return {"error": "No data extracted from jsonResponse"}
 
         print("Prompt",prompts) 
-        return {"prompt": prompts}
+        return {
+            "prompt": prompts,
+            "promptFormat": template.name,
+            "promptVersion": template.version,
+            "promptChars": len(prompts),
+            "promptTokens": estimate_tokens(prompts),
+        }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# Per-symptom statistics (mean, slope, max, last vs baseline, high-value
+# counts) computed on the columnar symptom store rather than the prompt text
+@app.post("/getSymptomStats/", openapi_extra=REQUEST_PAYLOAD_OPENAPI)
+async def getSymptomStats(request: Request, since: Optional[str] = None, until: Optional[str] = None,
+                          lastNDays: Optional[int] = None, highThreshold: float = 7.0, baselineLogs: int = 3,
+                          perDisease: bool = False):
+    data = await readRequestPayload(request)
+    try:
+        data = windowedPayload(data, since, until, lastNDays)
+        _, extracted_data, _ = collectSymptomLogs(data)
+        store = SymptomStore.from_extracted(extracted_data)
+        response = {"logs": len(store), "symptoms": store.stats(highThreshold, baselineLogs)}
+        if perDisease:
+            response["diseases"] = {
+                ds_name: store.stats(highThreshold, baselineLogs, disease=ds_name)
+                for ds_name in store.disease_names
+            }
+        return response
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/promptTemplates/")
+async def promptTemplatesList():
+    return {"default": DEFAULT_PROMPT_FORMAT, "templates": prompt_templates.describe()}
+
+
+@app.get("/cacheStats/")
+async def cacheStats():
+    return insight_cache.stats()
+
+
+@app.get("/threadStats/")
+async def threadStats():
+    return {
+        **thread_leases.stats(),
+        "poller": run_poller.stats(),
+        "single_flight": single_flight.stats(),
+        "jobs": job_queue.stats(),
+    }
+
+
+@app.get("/insightStats/")
+async def insightStats():
+    return insight_normalizer.stats()
+
+
+@app.get("/admissionStats/")
+async def admissionStats():
+    return admission.stats()
+
+
+@app.get("/responseStats/")
+async def responseStats():
+    return {"json": encode_stats.stats(), "compression": compression_stats.stats()}
+
+
 @app.get("/")
 async def healthCheck():
     try:
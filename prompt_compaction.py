@@ -0,0 +1,44 @@
+import re
+
+from symptom_store import SymptomStore, trend_label
+
+
+# Words, numbers and single punctuation marks. Close enough to the model's
+# BPE token count for prompts like ours without shipping a tokenizer.
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text):
+    return len(TOKEN_PATTERN.findall(text))
+
+
+def compact_sections(template, extracted_data, trends, recent_logs):
+    for idx, (ds_name, details) in enumerate(extracted_data, 1):
+        lines = [template.disease(idx, ds_name, details[0]["date"], details[0]["time"], len(details))]
+        recent = sorted(details, key=lambda log: log["timestamp"])[-recent_logs:] if recent_logs > 0 else []
+        if recent:
+            lines.append(template.recent_heading(len(recent), len(details)))
+        for log in recent:
+            lines.append(template.log(log["date"], log["time"], template.symptoms(log["symptoms"])))
+        yield "".join(lines)
+
+    if trends:
+        lines = [template.trend_heading]
+        for title, stats in trends.items():
+            lines.append(template.trend(**stats, title=title, trend=trend_label(stats)))
+        yield "".join(lines)
+
+
+def build_compact_prompt(template, header, extracted_data, token_budget=None, recent_logs=3):
+    # Keeps halving the number of raw logs per disease until the prompt fits
+    # the budget. Per-symptom summaries are always kept, so the result can
+    # still exceed a very small budget. Returns (sections, estimated tokens).
+    footer = template.request
+    fixed_tokens = estimate_tokens(header) + estimate_tokens(footer)
+    trends = SymptomStore.from_extracted(extracted_data).stats()
+    while True:
+        body = list(compact_sections(template, extracted_data, trends, recent_logs))
+        tokens = fixed_tokens + sum(estimate_tokens(section) for section in body)
+        if token_budget is None or tokens <= token_budget or recent_logs <= 0:
+            return [header, *body, footer], tokens
+        recent_logs //= 2
@@ -0,0 +1,206 @@
+import bisect
+from collections import OrderedDict
+from datetime import timezone
+
+
+class _DiseaseLogs:
+    def __init__(self, ds_name):
+        self.ds_name = ds_name
+        # Sorted (timestamp, arrival) keys and the log stored under each
+        self.order = []
+        self.logs = {}
+        # Joined log lines, None when they need rebuilding
+        self.body = None
+
+
+class _ResidentState:
+    def __init__(self):
+        self.header = ""
+        self.diseases = OrderedDict()
+        # record key -> (disease key, updatedAt, log key or None)
+        self.records = {}
+        self.arrivals = 0
+        self.last_updated_at = None
+        self.prompt = None
+
+
+class PromptStateStore:
+    """Materialized prompts of "full" layout templates, kept per resident.
+
+    Each update only parses and renders the records that are new or whose
+    updatedAt changed since the last call. Everything else is reused from
+    the stored per-disease sections. Records are kept in time order, so
+    records arriving late or out of order land in the right place. The
+    result is the prompt extractData would build from the merged records
+    sorted by updatedAt within each disease. State is kept separately for
+    each template version.
+
+    Records are identified by their id (``id`` or ``_id``), or else by
+    disease and recordName. A payload may carry only new and changed
+    records, so records it lacks are kept, unless full_sync says it is the
+    complete history. State lives in memory and may be evicted, so update()
+    reports when it started from nothing; a client that sent only a delta
+    must then resend everything.
+    """
+
+    def __init__(self, parse_timestamp, record_symptoms, max_residents=1000):
+        # parse_timestamp(str) -> (datetime, log_date, log_time) or None
+        self._parse_timestamp = parse_timestamp
+        # record_symptoms(record dict) -> {title: value} of the logged symptoms
+        self._record_symptoms = record_symptoms
+        self.max_residents = max_residents
+        self._states = OrderedDict()
+        self.records_processed = 0
+        self.records_skipped = 0
+        self.records_removed = 0
+
+    def update(self, resident_id, apiResponse, template, full_sync=False):
+        # Returns (prompt, number of new or changed records, number of removed
+        # records, last seen updatedAt, whether the state was created fresh)
+        if template.layout != "full":
+            raise ValueError(f"Incremental prompts need a 'full' layout template, got '{template.layout}'")
+        state_key = (template.version, resident_id)
+        state = self._states.get(state_key)
+        reset = state is None
+        if reset:
+            state = self._states[state_key] = _ResidentState()
+            while len(self._states) > self.max_residents:
+                self._states.popitem(last=False)
+        self._states.move_to_end(state_key)
+
+        # Checked before anything is stored, so a rejected payload leaves the
+        # state as it was
+        record_keys = self._record_keys(apiResponse)
+        header = template.personal_info(apiResponse.get("resident", {}))
+        changed = 0
+        seen = set()
+        for disease, keys in zip(apiResponse.get("diseases", []), record_keys):
+            disease_key = disease.get("disease_id") or disease.get("ds_name")
+            disease_logs = state.diseases.get(disease_key)
+            if disease_logs is None:
+                disease_logs = state.diseases[disease_key] = _DiseaseLogs(disease.get("ds_name"))
+            disease_logs.ds_name = disease.get("ds_name")
+
+            for record, record_key in zip(disease.get("records", []), keys):
+                updated_at = record.get("updatedAt") or ""
+                seen.add(record_key)
+                known = state.records.get(record_key)
+                if known is not None and known[1] == updated_at:
+                    self.records_skipped += 1
+                    continue
+
+                changed += 1
+                if known is not None:
+                    self._remove_log(state, known)
+                log_key = self._insert_log(state, disease_logs, record, updated_at, template)
+                state.records[record_key] = (disease_key, updated_at, log_key)
+
+        removed = 0
+        if full_sync:
+            for record_key in [key for key in state.records if key not in seen]:
+                self._remove_log(state, state.records.pop(record_key))
+                removed += 1
+
+        self.records_processed += changed
+        self.records_removed += removed
+        if changed or removed or state.prompt is None or header != state.header:
+            state.header = header
+            state.prompt = self._render(state, template)
+        return state.prompt, changed, removed, state.last_updated_at, reset
+
+    def forget(self, resident_id):
+        for state_key in [key for key in self._states if key[1] == resident_id]:
+            del self._states[state_key]
+
+    def stats(self):
+        return {
+            "residents": len({resident_id for _, resident_id in self._states}),
+            "records_processed": self.records_processed,
+            "records_skipped": self.records_skipped,
+            "records_removed": self.records_removed,
+        }
+
+    @staticmethod
+    def _record_keys(apiResponse):
+        # Per disease, the key of each record: its id, or else the disease and
+        # recordName, which must then be unique so that an edited record
+        # replaces its earlier version instead of being added next to it
+        record_keys = []
+        unnamed = set()
+        for disease in apiResponse.get("diseases", []):
+            disease_key = disease.get("disease_id") or disease.get("ds_name")
+            keys = []
+            for record in disease.get("records", []):
+                record_key = record.get("id") or record.get("_id")
+                if not record_key:
+                    record_key = (disease_key, record.get("recordName"))
+                    if record_key in unnamed:
+                        raise ValueError(
+                            f"Records without an id need a unique recordName per disease for incremental "
+                            f"prompts, '{record.get('recordName')}' appears more than once in '{disease_key}'"
+                        )
+                    unnamed.add(record_key)
+                keys.append(record_key)
+            record_keys.append(keys)
+        return record_keys
+
+    def _insert_log(self, state, disease_logs, record, updated_at, template):
+        parsed = self._parse_timestamp(updated_at) if updated_at else None
+        if parsed is None:
+            return None
+        record_date, log_date, log_time = parsed
+        sort_time = record_date
+        if sort_time.tzinfo is not None:
+            sort_time = sort_time.astimezone(timezone.utc).replace(tzinfo=None)
+        if state.last_updated_at is None or sort_time > state.last_updated_at:
+            state.last_updated_at = sort_time
+
+        symptoms = self._record_symptoms(record)
+        if not symptoms:
+            return None
+
+        state.arrivals += 1
+        log_key = (sort_time, state.arrivals)
+        disease_logs.logs[log_key] = {
+            "date": log_date,
+            "time": log_time,
+            "line": template.log(log_date, log_time, template.symptoms(symptoms)),
+            "common": [(title, template.common(log_date, log_time, title, value)) for title, value in symptoms.items()],
+        }
+        bisect.insort(disease_logs.order, log_key)
+        disease_logs.body = None
+        return log_key
+
+    def _remove_log(self, state, known):
+        disease_key, _, log_key = known
+        disease_logs = state.diseases.get(disease_key)
+        if log_key is None or disease_logs is None:
+            return
+        index = bisect.bisect_left(disease_logs.order, log_key)
+        if index < len(disease_logs.order) and disease_logs.order[index] == log_key:
+            del disease_logs.order[index]
+        disease_logs.logs.pop(log_key, None)
+        disease_logs.body = None
+
+    def _render(self, state, template):
+        active = [disease_logs for disease_logs in state.diseases.values() if disease_logs.order]
+        if not active:
+            return state.header + template.no_data
+
+        parts = [state.header, template.heading]
+        common = {}
+        for idx, disease_logs in enumerate(active, 1):
+            first = disease_logs.logs[disease_logs.order[0]]
+            parts.append(template.disease(idx, disease_logs.ds_name, first["date"], first["time"], len(disease_logs.order)))
+            if disease_logs.body is None:
+                disease_logs.body = "".join([disease_logs.logs[key]["line"] for key in disease_logs.order])
+            parts.append(disease_logs.body)
+            for key in disease_logs.order:
+                for title, line in disease_logs.logs[key]["common"]:
+                    common.setdefault(title, []).append(line)
+
+        parts.append(template.common_heading)
+        for lines in common.values():
+            parts.extend(lines)
+        parts.append(template.request)
+        return "".join(parts)
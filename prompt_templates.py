@@ -0,0 +1,253 @@
+import hashlib
+import json
+import string
+
+from prompt_compaction import build_compact_prompt
+from symptom_store import SymptomStore, trend_label
+
+
+# Fields each fragment may use, in the order its renderer takes them
+# positionally. Fragments without fields are plain strings.
+SLOT_FIELDS = {
+    "header": ("name", "age", "gender", "details"),
+    "age": ("age",),
+    "gender": ("gender",),
+    "no_data": (),
+    "heading": (),
+    "disease": ("idx", "ds_name", "date", "time", "logs"),
+    "log": ("date", "time", "symptoms"),
+    "symptom": ("title", "value"),
+    "symptom_separator": (),
+    "common_heading": (),
+    "common": ("date", "time", "title", "value"),
+    "request": (),
+    "recent_heading": ("recent", "logs"),
+    "trend_heading": (),
+    "trend": ("title", "count", "first_date", "last_date", "first", "last", "mean", "min", "max",
+              "high_count", "trend"),
+    "summary_heading": ("ds_name",),
+}
+SLOT_FIELDS["summary"] = SLOT_FIELDS["trend"]
+# Slots rendered from a stats dict, so they also accept (and ignore) extra keys
+STATS_SLOTS = ("trend", "summary")
+
+LAYOUTS = ("full", "compact", "per_disease")
+RESIDENT_FIELDS = ("name", "age", "gender")
+
+
+FULL_FRAGMENTS = {
+    "header": "Personal Information: Name: {name}.{details}",
+    "age": " Age: {age}.",
+    "gender": " Gender: {gender}.",
+    "no_data": "\nThere is no disease or symptom recorded recently.",
+    "heading": "\nMedical History and Symptoms:",
+    "disease": "\n{idx}. {ds_name}, Date of Diagnosis: {date} at {time} with multiple symptom logs.",
+    "log": "\nSymptom Log at {date}, {time}: {symptoms}.",
+    "symptom": "{title}: {value}/10",
+    "symptom_separator": ", ",
+    "common_heading": "\n\nCommon Symptoms Logged Over Time:",
+    "common": "\n{date}, {time}: {title}: {value}/10.",
+    "request": "\n\nRequest: Provide guidance or recommendations for medication based on the above symptoms and conditions.",
+}
+
+DEFAULT_TEMPLATES = {
+    "full": {
+        "layout": "full",
+        "defaults": {"name": "Unknown"},
+        "fragments": FULL_FRAGMENTS,
+    },
+    # Per-symptom trend summaries plus the most recent logs of each disease
+    "compact": {
+        "layout": "compact",
+        "defaults": {"name": "Unknown"},
+        "fragments": {
+            **FULL_FRAGMENTS,
+            "disease": "\n{idx}. {ds_name}, Date of Diagnosis: {date} at {time} with {logs} symptom logs.",
+            "recent_heading": "\nMost recent {recent} of {logs} logs:",
+            "trend_heading": "\n\nSymptom Trends Over Time:",
+            "trend": "\n{title}: {count} logs from {first_date} to {last_date}; first {first:g}/10, "
+                     "last {last:g}/10, min {min:g}/10, max {max:g}/10, trend {trend}.",
+        },
+    },
+    # Every disease with its own logs and symptom summary, no shared section
+    "per_disease": {
+        "layout": "per_disease",
+        "defaults": {"name": "Unknown"},
+        "fragments": {
+            **FULL_FRAGMENTS,
+            "disease": "\n\n{idx}. {ds_name}, Date of Diagnosis: {date} at {time} with {logs} symptom logs.",
+            "summary_heading": "\nSymptom summary for {ds_name}:",
+            "summary": "\n- {title}: {count} logs, mean {mean:g}/10, latest {last:g}/10, "
+                       "highest {max:g}/10, trend {trend}.",
+        },
+    },
+    # Wording of the JWT service: "Unknown" for missing details, 15-day window
+    "recent_15d": {
+        "layout": "full",
+        "defaults": {"name": "Unknown", "age": "Unknown", "gender": "Unknown"},
+        "fragments": {
+            **FULL_FRAGMENTS,
+            "header": "Personal Information: Name: {name}, Age: {age}, Gender: {gender}.",
+            "age": "",
+            "gender": "",
+            "no_data": "\nThere is no disease or symptom added recently within the past 15 days.",
+        },
+    },
+}
+
+
+def compile_fragment(slot, text):
+    # Turns a str.format-style fragment into a function of the slot's fields,
+    # called positionally or by name, that formats with the bound text.format.
+    # Only the slot's own field names are accepted, without attribute or
+    # index access, so formatting can do nothing but render those values.
+    fields = SLOT_FIELDS[slot]
+    for _, field_name, format_spec, conversion in string.Formatter().parse(text):
+        if field_name is None:
+            continue
+        if field_name not in fields:
+            raise ValueError(f"Unknown field '{{{field_name}}}' in prompt fragment '{slot}', expected one of: {', '.join(fields)}")
+        if conversion not in (None, "r", "s", "a") or any(c in (format_spec or "") for c in "{}\\"):
+            raise ValueError(f"Unsupported format for '{{{field_name}}}' in prompt fragment '{slot}'")
+    if not fields:
+        return text
+    render = text.format
+
+    # str.format ignores keys the text does not use, which lets STATS_SLOTS
+    # take a whole stats dict
+    def fragment(*args, **values):
+        return render(**dict(zip(fields, args)), **values)
+
+    return fragment
+
+
+class PromptTemplate:
+    """One prompt format, compiled once.
+
+    Every fragment becomes an attribute: a string for fixed text, or a
+    function for text with fields (see SLOT_FIELDS). ``version`` hashes the
+    layout, defaults and fragments, so it changes whenever the wording does.
+    """
+
+    def __init__(self, name, layout, fragments, defaults=None):
+        if layout not in LAYOUTS:
+            raise ValueError(f"Unknown prompt layout '{layout}', expected one of: {', '.join(LAYOUTS)}")
+        missing = [slot for slot in FULL_FRAGMENTS if slot not in fragments]
+        if missing:
+            raise ValueError(f"Prompt template '{name}' is missing fragments: {', '.join(missing)}")
+        self.name = name
+        self.layout = layout
+        self.fragments = dict(fragments)
+        self.defaults = dict(defaults or {})
+        for slot, text in self.fragments.items():
+            if slot not in SLOT_FIELDS:
+                raise ValueError(f"Unknown prompt fragment '{slot}'")
+            setattr(self, slot, compile_fragment(slot, text))
+        # The joined symptom list of a log line in one comprehension rather
+        # than one fragment call per symptom
+        separator, symptom = self.fragments["symptom_separator"], self.fragments["symptom"].format
+        self.symptoms = lambda symptoms: separator.join(
+            [symptom(title=title, value=value) for title, value in symptoms.items()]
+        )
+        definition = {"layout": layout, "fragments": self.fragments, "defaults": self.defaults}
+        self.version = hashlib.sha256(json.dumps(definition, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+    def personal_info(self, resident):
+        name, age, gender = (resident.get(key, self.defaults.get(key)) for key in RESIDENT_FIELDS)
+        details = []
+        if age is not None and self.fragments["age"]:
+            details.append(self.age(age))
+        if gender is not None and self.fragments["gender"]:
+            details.append(self.gender(gender))
+        return self.header(name, age, gender, "".join(details))
+
+    def describe(self):
+        return {"name": self.name, "layout": self.layout, "version": self.version}
+
+
+class PromptTemplateRegistry:
+    def __init__(self, definitions=DEFAULT_TEMPLATES):
+        self._templates = {}
+        for name, definition in definitions.items():
+            self.register(name, **definition)
+
+    def register(self, name, layout=None, fragments=None, defaults=None, base=None):
+        # base names a registered template whose layout, defaults and
+        # fragments are the starting point for this one
+        parent = self._templates[base] if base else None
+        template = PromptTemplate(
+            name,
+            layout or (parent.layout if parent else "full"),
+            {**(parent.fragments if parent else {}), **(fragments or {})},
+            {**(parent.defaults if parent else {}), **(defaults or {})},
+        )
+        self._templates[name] = template
+        return template
+
+    def load_file(self, path):
+        # JSON object of {name: {"base", "layout", "fragments", "defaults"}}
+        with open(path) as f:
+            for name, definition in json.load(f).items():
+                self.register(name, **definition)
+
+    def get(self, name):
+        return self._templates.get(name)
+
+    def names(self):
+        return list(self._templates)
+
+    def describe(self):
+        return [template.describe() for template in self._templates.values()]
+
+
+def render_sections(template, resident, extracted_data, common_symptoms, token_budget=None, recent_logs=3):
+    # Yields the prompt section by section. token_budget and recent_logs
+    # only apply to the compact layout.
+    personal_info = template.personal_info(resident)
+
+    # If no data found
+    if not extracted_data:
+        yield personal_info + template.no_data
+        return
+
+    if template.layout == "compact":
+        sections, _ = build_compact_prompt(template, personal_info + template.heading, extracted_data, token_budget, recent_logs)
+        yield from sections
+        return
+    yield personal_info + template.heading
+
+    if template.layout == "per_disease":
+        for idx, (ds_name, details) in enumerate(extracted_data, 1):
+            yield "".join(per_disease_lines(template, idx, ds_name, details))
+        yield template.request
+        return
+
+    # The per-log renderers are looked up once, outside the loops
+    render_log, render_symptoms, render_common = template.log, template.symptoms, template.common
+    for idx, (ds_name, details) in enumerate(extracted_data, 1):
+        lines = [template.disease(idx, ds_name, details[0]["date"], details[0]["time"], len(details))]
+        for log in details:
+            lines.append(render_log(log["date"], log["time"], render_symptoms(log["symptoms"])))
+        yield "".join(lines)
+
+    # Add common symptoms over time
+    if common_symptoms:
+        lines = [template.common_heading]
+        for title, occurrences in common_symptoms.items():
+            for log_date, log_time, value in occurrences:
+                lines.append(render_common(log_date, log_time, title, value))
+        yield "".join(lines)
+
+    # Add the request
+    yield template.request
+
+
+def per_disease_lines(template, idx, ds_name, details):
+    yield template.disease(idx, ds_name, details[0]["date"], details[0]["time"], len(details))
+    for log in details:
+        yield template.log(log["date"], log["time"], template.symptoms(log["symptoms"]))
+    summaries = SymptomStore.from_extracted([(ds_name, details)]).stats()
+    if summaries:
+        yield template.summary_heading(ds_name)
+        for title, stats in summaries.items():
+            yield template.summary(**stats, title=title, trend=trend_label(stats))
@@ -0,0 +1,179 @@
+import gzip
+import time
+
+import anyio
+import orjson
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+
+class EncodeStats:
+    """Running totals of JSON body sizes and render times."""
+
+    def __init__(self):
+        self.responses = 0
+        self.bytes = 0
+        self.encode_ms = 0.0
+        self.max_encode_ms = 0.0
+
+    def record(self, size, elapsed_ms):
+        self.responses += 1
+        self.bytes += size
+        self.encode_ms += elapsed_ms
+        self.max_encode_ms = max(self.max_encode_ms, elapsed_ms)
+
+    def stats(self):
+        return {
+            "responses": self.responses,
+            "bytes": self.bytes,
+            "avg_encode_ms": round(self.encode_ms / self.responses, 4) if self.responses else 0.0,
+            "max_encode_ms": round(self.max_encode_ms, 4),
+        }
+
+
+encode_stats = EncodeStats()
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON response rendered with orjson, with size and render time recorded."""
+
+    def render(self, content):
+        started = time.perf_counter()
+        body = orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+        encode_stats.record(len(body), (time.perf_counter() - started) * 1000)
+        return body
+
+
+class CompressionStats:
+    def __init__(self):
+        self.paths = {}
+        self.encodings = {}
+        self.streamed = 0
+
+    def record(self, path, encoding, raw_size, sent_size, elapsed_ms):
+        path_stats = self.paths.setdefault(path, {"responses": 0, "raw_bytes": 0, "sent_bytes": 0})
+        path_stats["responses"] += 1
+        path_stats["raw_bytes"] += raw_size
+        path_stats["sent_bytes"] += sent_size
+        encoding_stats = self.encodings.setdefault(encoding, {"responses": 0, "raw_bytes": 0, "sent_bytes": 0, "compress_ms": 0.0})
+        encoding_stats["responses"] += 1
+        encoding_stats["raw_bytes"] += raw_size
+        encoding_stats["sent_bytes"] += sent_size
+        encoding_stats["compress_ms"] += elapsed_ms
+
+    def stats(self):
+        def ratio(entry):
+            return round(entry["sent_bytes"] / entry["raw_bytes"], 4) if entry["raw_bytes"] else 1.0
+
+        return {
+            "streamed": self.streamed,
+            "encodings": {
+                name: {**entry, "compress_ms": round(entry["compress_ms"], 2), "ratio": ratio(entry)}
+                for name, entry in self.encodings.items()
+            },
+            "paths": {path: {**entry, "ratio": ratio(entry)} for path, entry in self.paths.items()},
+        }
+
+
+def negotiate_encoding(accept_encoding):
+    # Highest-q encoding we support; brotli wins ties since it compresses text better
+    weights = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name.strip().lower()] = q
+    candidates = ["br", "gzip"] if brotli is not None else ["gzip"]
+    best, best_q = None, 0.0
+    for name in candidates:
+        q = weights.get(name, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+class CompressionMiddleware:
+    """Compresses complete response bodies with brotli or gzip.
+
+    The encoding is picked from Accept-Encoding. Bodies under minimum_size,
+    bodies that are already encoded and streamed responses (SSE, NDJSON,
+    streamed prompts) are passed through unchanged, so streams keep flushing
+    chunk by chunk. Large bodies are compressed in a worker thread.
+    """
+
+    def __init__(self, app, minimum_size=1024, gzip_level=6, brotli_quality=5,
+                 thread_threshold=256 * 1024, stats=None):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.thread_threshold = thread_threshold
+        self.stats = stats or CompressionStats()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        start_message = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start_message, passthrough
+            if passthrough:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+
+            passthrough = True
+            body = message.get("body", b"")
+            headers = MutableHeaders(scope=start_message)
+            if message.get("more_body", False):
+                self.stats.streamed += 1
+                await send(start_message)
+                await send(message)
+                return
+            if encoding is None or len(body) < self.minimum_size or "content-encoding" in headers:
+                self.stats.record(self._path(scope), "identity", len(body), len(body), 0.0)
+                await send(start_message)
+                await send(message)
+                return
+
+            started = time.perf_counter()
+            if len(body) >= self.thread_threshold:
+                compressed = await anyio.to_thread.run_sync(self._compress, encoding, body)
+            else:
+                compressed = self._compress(encoding, body)
+            self.stats.record(self._path(scope), encoding, len(body), len(compressed),
+                              (time.perf_counter() - started) * 1000)
+
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(compressed))
+            headers.add_vary_header("Accept-Encoding")
+            await send(start_message)
+            await send({"type": "http.response.body", "body": compressed, "more_body": False})
+
+        await self.app(scope, receive, send_compressed)
+
+    @staticmethod
+    def _path(scope):
+        # The matched route template, so /jobs/{job_id} is counted as one path
+        return getattr(scope.get("route"), "path", scope["path"])
+
+    def _compress(self, encoding, body):
+        if encoding == "br":
+            return brotli.compress(body, quality=self.brotli_quality)
+        return gzip.compress(body, compresslevel=self.gzip_level)
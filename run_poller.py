@@ -0,0 +1,152 @@
+import asyncio
+import random
+import time
+
+
+# Statuses after which a run will not change any more. "requires_action" is
+# not strictly final, but nothing in this service submits tool outputs, so a
+# run in that state would otherwise sit there until it expires.
+TERMINAL_STATUSES = {"completed", "failed", "cancelled", "expired", "incomplete", "requires_action"}
+
+
+class RunPollTimeout(Exception):
+    pass
+
+
+class _TrackedRun:
+    def __init__(self, thread_id, run_id, interval):
+        self.thread_id = thread_id
+        self.run_id = run_id
+        self.interval = interval
+        self.next_poll = time.monotonic() + interval
+        # True while a retrieve for this run is in flight
+        self.polling = False
+        self.errors = 0
+        self.future = asyncio.get_running_loop().create_future()
+        self.waiters = 0
+
+
+class RunPoller:
+    """Shared poller for every in-flight assistant run of the process.
+
+    Callers register a (thread_id, run_id) pair and await its final run
+    object. A single background task schedules the polls of all tracked
+    runs, starting fast and backing off exponentially (with jitter) per run,
+    so short runs are picked up quickly and long runs do not burn API calls.
+    Each poll runs as its own task with a ``retrieve_timeout``, so one slow
+    retrieve holds up neither the other runs nor any caller's timeout.
+    """
+
+    def __init__(self, retrieve, initial_interval=0.25, max_interval=4.0, backoff=1.6,
+                 jitter=0.2, max_errors=3, max_concurrent_polls=20, retrieve_timeout=10.0):
+        # retrieve(thread_id, run_id) -> awaitable run object with a .status
+        self._retrieve = retrieve
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.jitter = jitter
+        self.max_errors = max_errors
+        self.max_concurrent_polls = max_concurrent_polls
+        self.retrieve_timeout = retrieve_timeout
+        self._runs = {}
+        self._polls = set()
+        self._wakeup = None
+        self._task = None
+        self.api_calls = 0
+        self.resolved = 0
+
+    async def wait(self, thread_id, run_id, timeout=20.0):
+        self._ensure_started()
+        key = (thread_id, run_id)
+        tracked = self._runs.get(key)
+        if tracked is None:
+            tracked = _TrackedRun(thread_id, run_id, self.initial_interval)
+            self._runs[key] = tracked
+            self._wakeup.set()
+
+        tracked.waiters += 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(tracked.future), timeout)
+        except asyncio.TimeoutError:
+            raise RunPollTimeout(f"Run {run_id} did not finish in time")
+        finally:
+            tracked.waiters -= 1
+            # Stop polling runs nobody is waiting for any more
+            if tracked.waiters == 0 and not tracked.future.done():
+                tracked.future.cancel()
+                self._forget(key, tracked)
+
+    def stats(self):
+        return {
+            "in_flight": len(self._runs),
+            "polls_in_flight": len(self._polls),
+            "api_calls": self.api_calls,
+            "resolved": self.resolved,
+        }
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._poll_loop())
+
+    async def _poll_loop(self):
+        semaphore = asyncio.Semaphore(self.max_concurrent_polls)
+        loop = asyncio.get_running_loop()
+        while True:
+            now = time.monotonic()
+            for run in [run for run in self._runs.values() if not run.polling and run.next_poll <= now]:
+                run.polling = True
+                task = loop.create_task(self._poll_one(run, semaphore))
+                self._polls.add(task)
+                task.add_done_callback(self._poll_done)
+
+            self._wakeup.clear()
+            waiting = [run.next_poll for run in self._runs.values() if not run.polling]
+            delay = max(0.0, min(waiting) - now) if waiting else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def _poll_done(self, task):
+        self._polls.discard(task)
+        # The run can be scheduled again
+        self._wakeup.set()
+
+    async def _poll_one(self, tracked, semaphore):
+        key = (tracked.thread_id, tracked.run_id)
+        try:
+            async with semaphore:
+                self.api_calls += 1
+                run = await asyncio.wait_for(self._retrieve(tracked.thread_id, tracked.run_id), self.retrieve_timeout)
+        except Exception as e:
+            tracked.errors += 1
+            if tracked.errors >= self.max_errors:
+                self._resolve(key, tracked, exception=e)
+                return
+        else:
+            tracked.errors = 0
+            if run.status in TERMINAL_STATUSES:
+                self._resolve(key, tracked, result=run)
+                return
+        finally:
+            tracked.polling = False
+
+        tracked.interval = min(tracked.interval * self.backoff, self.max_interval)
+        spread = tracked.interval * self.jitter
+        tracked.next_poll = time.monotonic() + tracked.interval + random.uniform(-spread, spread)
+
+    def _forget(self, key, tracked):
+        # The same key may have been registered again since
+        if self._runs.get(key) is tracked:
+            del self._runs[key]
+
+    def _resolve(self, key, tracked, result=None, exception=None):
+        self._forget(key, tracked)
+        if tracked.future.done():
+            return
+        self.resolved += 1
+        if exception is not None:
+            tracked.future.set_exception(exception)
+        else:
+            tracked.future.set_result(result)
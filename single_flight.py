@@ -0,0 +1,71 @@
+import asyncio
+import time
+
+
+class SingleFlight:
+    """Coalesces concurrent calls that share a key into one execution.
+
+    The first caller for a key starts the work, and callers arriving while it
+    runs await the same result. With ``recent_ttl`` > 0 a successful result
+    is also handed to callers arriving up to that many seconds later.
+    """
+
+    def __init__(self, recent_ttl=0):
+        self.recent_ttl = recent_ttl
+        self._in_flight = {}
+        self._recent = {}
+        self.started = 0
+        self.joined = 0
+        self.recent_hits = 0
+
+    async def do(self, key, fn):
+        # Returns (result, shared); shared is False only for the caller whose
+        # fn actually ran
+        if self.recent_ttl > 0:
+            recent = self._recent.get(key)
+            if recent is not None:
+                expires_at, result = recent
+                if expires_at > time.monotonic():
+                    self.recent_hits += 1
+                    return result, True
+                del self._recent[key]
+
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.joined += 1
+            return await asyncio.shield(task), True
+
+        # The work runs as its own task, so a caller that disconnects does
+        # not cancel it for everybody else
+        task = asyncio.get_running_loop().create_task(fn())
+        self._in_flight[key] = task
+        task.add_done_callback(lambda done: self._finish(key, done))
+        self.started += 1
+        return await asyncio.shield(task), False
+
+    def joinable(self, key):
+        # Whether do(key, ...) would be answered without running fn
+        if key in self._in_flight:
+            return True
+        recent = self._recent.get(key)
+        return recent is not None and recent[0] > time.monotonic()
+
+    def stats(self):
+        return {
+            "in_flight": len(self._in_flight),
+            "started": self.started,
+            "joined": self.joined,
+            "recent_hits": self.recent_hits,
+        }
+
+    def _finish(self, key, task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if task.cancelled() or task.exception() is not None:
+            return
+        if self.recent_ttl > 0:
+            now = time.monotonic()
+            self._recent[key] = (now + self.recent_ttl, task.result())
+            # Drop expired results so the map does not grow without bound
+            for stale_key in [k for k, (expires_at, _) in self._recent.items() if expires_at <= now]:
+                del self._recent[stale_key]
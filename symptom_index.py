@@ -0,0 +1,53 @@
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+
+class SymptomIndex:
+    """Records of one payload sorted by timestamp, per disease.
+
+    Built once per payload. ``window`` then cuts any time range out of each
+    disease with a binary search (``np.searchsorted``) instead of testing
+    every record, so several windows (7/15/90 days) over a long history
+    cost one sort plus a few lookups.
+    """
+
+    def __init__(self, apiResponse, parse_bulk):
+        # parse_bulk(list of str) -> (parsed list, datetime64 array, NaT if invalid)
+        self.resident = apiResponse.get("resident", {})
+        self.diseases = []
+        diseases_data = apiResponse.get("diseases", [])
+        date_strs = [
+            record.get("updatedAt") or ""
+            for disease in diseases_data
+            for record in disease.get("records", [])
+        ]
+        _, times = parse_bulk(date_strs)
+
+        start = 0
+        for disease in diseases_data:
+            records = disease.get("records", [])
+            disease_times = times[start:start + len(records)]
+            start += len(records)
+
+            valid = np.flatnonzero(~np.isnat(disease_times))
+            order = valid[np.argsort(disease_times[valid], kind="stable")]
+            self.diseases.append((
+                {key: value for key, value in disease.items() if key != "records"},
+                [records[i] for i in order],
+                disease_times[order],
+            ))
+
+    def window(self, since=None, until=None):
+        # Payload with only the records in [since, until]; both bounds are
+        # optional naive-UTC datetimes
+        diseases = []
+        for disease, records, times in self.diseases:
+            lo = np.searchsorted(times, np.datetime64(since, "us"), side="left") if since else 0
+            hi = np.searchsorted(times, np.datetime64(until, "us"), side="right") if until else len(records)
+            diseases.append({**disease, "records": records[lo:hi]})
+        return {"resident": self.resident, "diseases": diseases}
+
+    def last_days(self, days, now=None):
+        now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+        return self.window(since=now - timedelta(days=days))
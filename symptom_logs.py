@@ -0,0 +1,130 @@
+from datetime import datetime, timezone
+from functools import lru_cache
+
+import numpy as np
+from fastapi import HTTPException
+
+from symptom_index import SymptomIndex
+
+
+# Symptom records are often saved in batches that share one updatedAt, so
+# parsing and formatting is memoized per timestamp string. Returns
+# (record_date, log_date, log_time), or None if the string is not ISO 8601.
+@lru_cache(maxsize=8192)
+def parseRecordTimestamp(record_date_str):
+    # Parse the ISO 8601 date format with UTC timezone
+    try:
+        record_date = datetime.fromisoformat(record_date_str.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return record_date, record_date.strftime("%d %B %Y"), record_date.strftime("%I:%M %p")
+
+
+# Parses all timestamps of a payload in one pass. Each distinct string is
+# parsed once and the results are gathered back with a NumPy index, which
+# also yields a datetime64 array (UTC, NaT for invalid dates) for sorting
+# and range lookups. Returns (parsed list, datetime64 array).
+def parseTimestampsBulk(date_strs):
+    if not date_strs:
+        return [], np.array([], dtype="datetime64[us]")
+    uniques, inverse = np.unique(np.array(date_strs, dtype=object), return_inverse=True)
+    unique_parsed = [parseRecordTimestamp(s) if s else None for s in uniques]
+    unique_times = np.array(
+        [toUTCNaive(parsed[0]) if parsed else None for parsed in unique_parsed],
+        dtype="datetime64[us]",
+    )
+    inverse = inverse.reshape(-1)
+    return [unique_parsed[i] for i in inverse], unique_times[inverse]
+
+
+def toUTCNaive(value):
+    # datetime64 has no timezone; aware datetimes are stored as UTC
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+# Symptoms with a positive value, rounded to two decimals
+def recordSymptoms(record):
+    return {
+        symptom.get("title"): round(symptom.get("value"), 2)
+        for symptom in record.get("symptoms", [])
+        if symptom.get('value', 0) > 0
+    }
+
+
+# Walks the payload once and groups the symptom logs per disease and per
+# symptom title. Returns (resident, extracted_data, common_symptoms).
+def collectSymptomLogs(apiResponse):
+    resident = apiResponse.get("resident", {})
+    diseases_data = apiResponse.get("diseases", [])
+    extracted_data = []
+    common_symptoms = {}
+
+    # Parse every timestamp of the payload up front, once per distinct value
+    date_strs = [
+        record.get("updatedAt") or ""
+        for disease in diseases_data
+        for record in disease.get("records", [])
+    ]
+    parsed_dates, record_times = parseTimestampsBulk(date_strs)
+    position = 0
+
+    # Iterate over each disease in the diseases list
+    for disease in diseases_data:
+        ds_name = disease.get("ds_name")
+        records = disease.get("records", [])
+
+        disease_details = []
+
+        for record in records:
+            parsed = parsed_dates[position]
+            record_time = record_times[position]
+            position += 1
+            # Skip records without a valid ISO 8601 date
+            if parsed is None:
+                continue
+            record_date, log_date, log_time = parsed
+
+            symptoms = recordSymptoms(record)
+
+            # Store the detailed log for the disease
+            if symptoms:
+                disease_details.append({
+                    "date": log_date,
+                    "time": log_time,
+                    "timestamp": record_time,
+                    "symptoms": symptoms
+                })
+
+                # Add to common symptoms
+                for title, value in symptoms.items():
+                    if title not in common_symptoms:
+                        common_symptoms[title] = []
+                    common_symptoms[title].append((log_date, log_time, value))
+
+        if disease_details:
+            extracted_data.append((ds_name, disease_details))
+
+    return resident, extracted_data, common_symptoms
+
+
+def parseWindowBound(value, name):
+    if not value:
+        return None
+    try:
+        return toUTCNaive(datetime.fromisoformat(value.replace("Z", "+00:00")))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid '{name}' date: {value}")
+
+
+# Restricts the payload to the records between since and until (ISO 8601),
+# or within the last last_n_days days. Pass a prebuilt SymptomIndex to cut
+# several windows out of the same payload without sorting it again.
+def windowedPayload(apiResponse, since=None, until=None, last_n_days=None, index=None):
+    if not (since or until or last_n_days):
+        return apiResponse
+    index = index or SymptomIndex(apiResponse, parseTimestampsBulk)
+    if last_n_days:
+        return index.last_days(last_n_days)
+    return index.window(parseWindowBound(since, "since"), parseWindowBound(until, "until"))
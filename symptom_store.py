@@ -0,0 +1,123 @@
+import numpy as np
+
+
+class SymptomStore:
+    """Column-oriented symptom history of one resident.
+
+    One row per symptom log, sorted by time: ``timestamps`` (datetime64),
+    the disease each log belongs to, and its formatted date/time. ``values``
+    is a (symptom x row) float matrix with NaN wherever a symptom was not
+    logged. All statistics are computed on whole arrays at once.
+    """
+
+    def __init__(self, timestamps, disease_index, log_dates, log_times, titles, values, disease_names):
+        self.timestamps = timestamps
+        self.disease_index = disease_index
+        self.log_dates = log_dates
+        self.log_times = log_times
+        self.titles = titles
+        self.values = values
+        self.disease_names = disease_names
+
+    @classmethod
+    def from_extracted(cls, extracted_data):
+        # extracted_data as built by collectSymptomLogs: [(ds_name, details)]
+        # where each detail carries date, time, timestamp and symptoms
+        logs = [(idx, log) for idx, (_, details) in enumerate(extracted_data) for log in details]
+        timestamps = np.array([log["timestamp"] for _, log in logs], dtype="datetime64[us]")
+        order = np.argsort(timestamps, kind="stable")
+        logs = [logs[i] for i in order]
+
+        title_rows = {}
+        cells_title, cells_row, cells_value = [], [], []
+        for row, (_, log) in enumerate(logs):
+            for title, value in log["symptoms"].items():
+                cells_title.append(title_rows.setdefault(title, len(title_rows)))
+                cells_row.append(row)
+                cells_value.append(value)
+
+        values = np.full((len(title_rows), len(logs)), np.nan)
+        values[cells_title, cells_row] = cells_value
+        return cls(
+            timestamps=timestamps[order],
+            disease_index=np.array([idx for idx, _ in logs], dtype=np.int32),
+            log_dates=np.array([log["date"] for _, log in logs], dtype=object),
+            log_times=np.array([log["time"] for _, log in logs], dtype=object),
+            titles=list(title_rows),
+            values=values,
+            disease_names=[ds_name for ds_name, _ in extracted_data],
+        )
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def stats(self, high_threshold=7.0, baseline_logs=3, disease=None):
+        # {title: {...}} per symptom. slope_per_day is the least-squares
+        # change per day; last_vs_baseline compares the last value with the
+        # mean of the first baseline_logs values; high_count counts values
+        # at or above high_threshold.
+        if disease is not None:
+            columns = np.flatnonzero(self.disease_index == self.disease_names.index(disease))
+        else:
+            columns = np.arange(len(self))
+        if not len(columns):
+            return {}
+        values = self.values[:, columns]
+        days = (self.timestamps[columns] - self.timestamps[columns[0]]) / np.timedelta64(1, "D")
+
+        logged = ~np.isnan(values)
+        counts = logged.sum(axis=1)
+        present = counts > 0
+        safe_counts = np.where(present, counts, 1)
+        filled = np.where(logged, values, 0.0)
+
+        means = filled.sum(axis=1) / safe_counts
+        maxima = np.where(logged, values, -np.inf).max(axis=1, initial=-np.inf)
+        minima = np.where(logged, values, np.inf).min(axis=1, initial=np.inf)
+        high_counts = (logged & (filled >= high_threshold)).sum(axis=1)
+
+        # Least-squares slope of value over days, per symptom
+        day_means = (logged * days).sum(axis=1) / safe_counts
+        day_dev = np.where(logged, days - day_means[:, None], 0.0)
+        value_dev = np.where(logged, values - means[:, None], 0.0)
+        denominators = (day_dev ** 2).sum(axis=1)
+        slopes = np.divide((day_dev * value_dev).sum(axis=1), denominators,
+                           out=np.zeros_like(denominators), where=denominators > 0)
+
+        first_cols = logged.argmax(axis=1)
+        last_cols = logged.shape[1] - 1 - logged[:, ::-1].argmax(axis=1)
+        rank = logged.cumsum(axis=1)
+        baseline_mask = logged & (rank <= baseline_logs)
+        baselines = (filled * baseline_mask).sum(axis=1) / np.maximum(baseline_mask.sum(axis=1), 1)
+        rows = np.arange(len(self.titles))
+        firsts = values[rows, first_cols]
+        lasts = values[rows, last_cols]
+        spans = days[last_cols] - days[first_cols]
+
+        result = {}
+        for i in np.flatnonzero(present):
+            result[self.titles[i]] = {
+                "count": int(counts[i]),
+                "first_date": self.log_dates[columns[first_cols[i]]],
+                "last_date": self.log_dates[columns[last_cols[i]]],
+                "first": round(float(firsts[i]), 2),
+                "last": round(float(lasts[i]), 2),
+                "mean": round(float(means[i]), 2),
+                "min": round(float(minima[i]), 2),
+                "max": round(float(maxima[i]), 2),
+                "slope_per_day": round(float(slopes[i]), 4),
+                "span_days": round(float(spans[i]), 2),
+                "last_vs_baseline": round(float(lasts[i] - baselines[i]), 2),
+                "high_count": int(high_counts[i]),
+            }
+        return result
+
+
+def trend_label(stats, threshold=0.5):
+    # Change the fitted line predicts over the logged period
+    change = stats["slope_per_day"] * stats["span_days"]
+    if change >= threshold:
+        return "increasing"
+    if change <= -threshold:
+        return "decreasing"
+    return "stable"
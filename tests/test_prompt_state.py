@@ -0,0 +1,121 @@
+"""Incremental prompts must match the prompt built from scratch.
+
+PromptStateStore.update() is fed randomized resident histories in shuffled
+chunks, then has records edited, and after each step its prompt is compared
+with extractData's output for the same records sorted by updatedAt. Run from
+the repository root:
+
+    python -m pytest tests
+"""
+import copy
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from prompt_state import PromptStateStore  # noqa: E402
+from prompt_templates import PromptTemplateRegistry, render_sections  # noqa: E402
+from symptom_logs import collectSymptomLogs, parseRecordTimestamp, recordSymptoms  # noqa: E402
+
+HISTORIES = 300
+TEMPLATE = PromptTemplateRegistry().get("full")
+
+
+def from_scratch(payload):
+    # What extractData builds for the payload, with each disease's records in time order
+    payload = copy.deepcopy(payload)
+    for disease in payload["diseases"]:
+        disease["records"].sort(key=lambda record: record["updatedAt"])
+    return "".join(render_sections(TEMPLATE, *collectSymptomLogs(payload)))
+
+
+def make_store():
+    return PromptStateStore(parse_timestamp=parseRecordTimestamp, record_symptoms=recordSymptoms)
+
+
+def timestamp(rng, serial):
+    # The serial keeps timestamps unique, so the expected order is unambiguous
+    return (f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T{rng.randint(0, 23):02d}:"
+            f"{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d}.{serial % 1000:03d}Z")
+
+
+def make_history(rng):
+    diseases = []
+    serial = 0
+    for d in range(rng.randint(1, 4)):
+        records = []
+        for _ in range(rng.randint(0, 25)):
+            serial += 1
+            record = {
+                "recordName": f"record {serial}",
+                "updatedAt": timestamp(rng, serial),
+                "symptoms": [
+                    {"title": rng.choice("ABCD"), "value": rng.choice([0, 1, 2.5, 7])}
+                    for _ in range(rng.randint(0, 3))
+                ],
+            }
+            # Some records come without an id and are known by their recordName
+            if rng.random() < 0.7:
+                record["_id"] = f"r{serial}"
+            records.append(record)
+        diseases.append({"disease_id": f"d{d}", "ds_name": f"Disease {d}", "records": records})
+    return {"resident": {"name": "Resident", "age": 80, "gender": "F"}, "diseases": diseases}
+
+
+def delta(history, picked):
+    # A payload with only the picked (disease index, record) pairs
+    return {
+        "resident": history["resident"],
+        "diseases": [
+            {"disease_id": disease["disease_id"], "ds_name": disease["ds_name"],
+             "records": [record for index, record in picked if index == d]}
+            for d, disease in enumerate(history["diseases"])
+        ],
+    }
+
+
+@pytest.mark.parametrize("seed", range(HISTORIES))
+def test_incremental_prompt_matches_full_build(seed):
+    rng = random.Random(seed)
+    history = make_history(rng)
+    records = [(d, record) for d, disease in enumerate(history["diseases"]) for record in disease["records"]]
+    rng.shuffle(records)
+    store = make_store()
+
+    chunks = rng.randint(1, 4)
+    for c in range(chunks):
+        prompt, _, _, _, _ = store.update("resident", delta(history, records[c::chunks]), TEMPLATE)
+    assert prompt == from_scratch(history)
+
+    # Sending everything again changes nothing
+    again, changed, removed, _, _ = store.update("resident", history, TEMPLATE)
+    assert (again, changed, removed) == (prompt, 0, 0)
+
+    # Edited records replace their earlier version, with or without an id
+    edited = []
+    for d, record in records[:rng.randint(0, 3)]:
+        update = dict(record, updatedAt=timestamp(rng, 999 - len(edited)), symptoms=[{"title": "A", "value": 9}])
+        disease_records = history["diseases"][d]["records"]
+        disease_records[disease_records.index(record)] = update
+        edited.append((d, update))
+    prompt, changed, _, _, _ = store.update("resident", delta(history, edited), TEMPLATE)
+    assert changed == len(edited)
+    assert prompt == from_scratch(history)
+
+    # A full sync drops the records it no longer lists
+    for disease in history["diseases"]:
+        del disease["records"][rng.randint(0, len(disease["records"])):]
+    prompt, _, _, _, _ = store.update("resident", history, TEMPLATE, full_sync=True)
+    assert prompt == from_scratch(history)
+
+
+def test_rejects_ambiguous_records_without_id():
+    store = make_store()
+    record = {"recordName": "Daily", "updatedAt": "2024-03-01T10:00:00.000Z", "symptoms": [{"title": "A", "value": 1}]}
+    payload = {"resident": {}, "diseases": [{"disease_id": "d", "ds_name": "D", "records": [record, dict(record)]}]}
+    with pytest.raises(ValueError):
+        store.update("resident", payload, TEMPLATE)
+    assert store.stats()["records_processed"] == 0
@@ -0,0 +1,155 @@
+import asyncio
+import time
+
+
+class ThreadLease:
+    def __init__(self, key, thread_id=None):
+        self.key = key
+        self._keyed = None
+        # None until the first run on this lease creates the thread
+        self.thread_id = thread_id
+        # The run started on this lease, cancelled if the lease is discarded
+        self.run_id = None
+
+
+class _KeyedThread:
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.thread_id = None
+        self.uses = 0
+        self.last_used = time.monotonic()
+
+
+class ThreadLeaseManager:
+    """Hands out assistant threads to concurrent requests.
+
+    A thread accepts only one active run at a time, so every request holds
+    a lease on the thread it runs on. Requests without a key get a fresh
+    thread of their own, deleted again on release. Requests with a key (for
+    example a resident id) share that key's thread one at a time, which
+    keeps a resident's runs in order. ``max_threads`` caps the number of
+    leases held at once. Keyed threads left idle for ``idle_ttl`` seconds,
+    or used more than ``max_uses`` times, are dropped so their history does
+    not grow forever. A discarded lease's unfinished run is cancelled before
+    its thread is deleted.
+    """
+
+    def __init__(self, max_threads=100, idle_ttl=900, max_uses=20, delete_thread=None,
+                 cleanup_interval=60, cancel_run=None):
+        self.max_threads = max_threads
+        self.idle_ttl = idle_ttl
+        self.max_uses = max_uses
+        self.cleanup_interval = cleanup_interval
+        # delete_thread(thread_id) -> awaitable, called for dropped threads
+        self._delete_thread = delete_thread
+        # cancel_run(thread_id, run_id) -> awaitable, for runs left unfinished
+        self._cancel_run = cancel_run
+        self._slots = None
+        self._keyed = {}
+        self._last_cleanup = time.monotonic()
+        self.in_use = 0
+        self.acquired = 0
+        self.reused = 0
+        self.dropped = 0
+        self.cancelled = 0
+
+    async def acquire(self, key=None):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_threads)
+        self._maybe_cleanup()
+
+        keyed = None
+        if key is not None:
+            keyed = self._keyed.get(key)
+            if keyed is None:
+                keyed = self._keyed[key] = _KeyedThread()
+            await keyed.lock.acquire()
+        try:
+            await self._slots.acquire()
+        except BaseException:
+            if keyed is not None:
+                keyed.lock.release()
+            raise
+
+        lease = ThreadLease(key, keyed.thread_id if keyed else None)
+        lease._keyed = keyed
+        if lease.thread_id is not None:
+            self.reused += 1
+        self.in_use += 1
+        self.acquired += 1
+        return lease
+
+    def release(self, lease, discard=False):
+        # discard=True when the run did not finish cleanly: the thread may
+        # still have an active run and must not be handed out again
+        self.in_use -= 1
+        self._slots.release()
+        unfinished_run = lease.run_id if discard else None
+        keyed = lease._keyed
+        if keyed is None:
+            # A thread of its own is never used again
+            self._drop_thread(lease.thread_id, unfinished_run)
+            return
+        keyed.last_used = time.monotonic()
+        if discard or lease.thread_id is None:
+            self._drop_thread(lease.thread_id, unfinished_run)
+            keyed.thread_id = None
+            keyed.uses = 0
+        else:
+            keyed.thread_id = lease.thread_id
+            keyed.uses += 1
+            if keyed.uses >= self.max_uses:
+                self._drop_thread(keyed.thread_id)
+                keyed.thread_id = None
+                keyed.uses = 0
+        keyed.lock.release()
+
+    def stats(self):
+        return {
+            "in_use": self.in_use,
+            "max_threads": self.max_threads,
+            "keyed_threads": sum(1 for keyed in self._keyed.values() if keyed.thread_id),
+            "acquired": self.acquired,
+            "reused": self.reused,
+            "dropped": self.dropped,
+            "cancelled": self.cancelled,
+        }
+
+    def _maybe_cleanup(self):
+        now = time.monotonic()
+        if now - self._last_cleanup < self.cleanup_interval:
+            return
+        self._last_cleanup = now
+        for key, keyed in list(self._keyed.items()):
+            if keyed.lock.locked() or now - keyed.last_used < self.idle_ttl:
+                continue
+            del self._keyed[key]
+            self._drop_thread(keyed.thread_id)
+
+    def _drop_thread(self, thread_id, run_id=None):
+        if thread_id is None:
+            return
+        self.dropped += 1
+        if self._cancel_run is None:
+            run_id = None
+        elif run_id is not None:
+            self.cancelled += 1
+        if self._delete_thread is not None or run_id is not None:
+            task = asyncio.get_running_loop().create_task(self._cleanup(thread_id, run_id))
+            task.add_done_callback(_ignore_result)
+
+    async def _cleanup(self, thread_id, run_id):
+        # A run that ended in the meantime makes cancel fail, which must not
+        # skip the delete
+        if run_id is not None:
+            try:
+                await self._cancel_run(thread_id, run_id)
+            except Exception:
+                pass
+        if self._delete_thread is not None:
+            await self._delete_thread(thread_id)
+
+
+def _ignore_result(task):
+    if not task.cancelled():
+        task.exception()
@@ -0,0 +1,109 @@
+import hashlib
+import heapq
+import threading
+import time
+from collections import OrderedDict
+
+
+class TokenClaimCache:
+    """Verified JWT claims, keyed by a digest of the token.
+
+    A token that was verified once is answered from memory until its
+    ``exp`` claim, so repeat requests skip the signature check. Entries are
+    dropped at ``exp`` (or after ``max_ttl`` seconds, if shorter), and the
+    least recently used ones go first when the cache is full. Tokens without
+    ``exp`` are never cached. Only the digest is stored, never the token.
+    """
+
+    def __init__(self, max_entries=10000, max_ttl=None):
+        self.max_entries = max_entries
+        self.max_ttl = max_ttl
+        self._entries = OrderedDict()
+        # (expires_at, key) of every stored entry, earliest first
+        self._expiry = []
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+        self.verifications = 0
+        self.verify_ms = 0.0
+        self.max_verify_ms = 0.0
+        self.lookup_ms = 0.0
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode("utf-8")).digest()
+
+    def verify(self, token, decode):
+        # decode(token) -> claims dict, raising if the token is invalid
+        started = time.perf_counter()
+        key = self._key(token)
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                self.lookup_ms += (time.perf_counter() - started) * 1000
+                return dict(entry[1])
+            self.misses += 1
+
+        started = time.perf_counter()
+        claims = decode(token)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        with self._lock:
+            self.verifications += 1
+            self.verify_ms += elapsed_ms
+            self.max_verify_ms = max(self.max_verify_ms, elapsed_ms)
+            expires_at = self._expires_at(claims, now)
+            if expires_at is not None and expires_at > now:
+                if key not in self._entries:
+                    heapq.heappush(self._expiry, (expires_at, key))
+                self._entries[key] = (expires_at, claims)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return dict(claims)
+
+    def clear(self):
+        # For key rotation: everything has to be verified again
+        with self._lock:
+            self._entries.clear()
+            self._expiry.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "expirations": self.expirations,
+                "evictions": self.evictions,
+                "avg_verify_ms": round(self.verify_ms / self.verifications, 4) if self.verifications else 0.0,
+                "max_verify_ms": round(self.max_verify_ms, 4),
+                "avg_hit_ms": round(self.lookup_ms / self.hits, 4) if self.hits else 0.0,
+            }
+
+    def _expires_at(self, claims, now):
+        exp = claims.get("exp")
+        if not isinstance(exp, (int, float)):
+            return None
+        if self.max_ttl is not None:
+            return min(exp, now + self.max_ttl)
+        return exp
+
+    def _expire(self, now):
+        # Drops entries whose exp has passed. Heap items of entries that were
+        # evicted or replaced since are skipped.
+        while self._expiry and self._expiry[0][0] <= now:
+            expires_at, key = heapq.heappop(self._expiry)
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == expires_at:
+                del self._entries[key]
+                self.expirations += 1